@@ -91,9 +91,16 @@ class Constants:
     HTML_MIMETYPE = "text/html"
     CSV_MIMETYPE = "text/csv"
     JSON_MIMETYPE = "application/json"
+    NDJSON_MIMETYPE = "application/x-ndjson"
     SQLITE3_MIMETYPE = "application/x-sqlite3"
     TAR_MIMETYPE = "application/x-tar"
     XLSX_MIMETYPE = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+    PARQUET_MIMETYPE = "application/vnd.apache.parquet"
+    ARROW_MIMETYPE = "application/vnd.apache.arrow.file"
+
+    # Max number of rows in an XLSX worksheet, and length of its title.
+    XLSX_MAX_ROWS = 1048576
+    XLSX_MAX_TITLE = 31
 
     # Miscellaneous.
     FRONT_MATTER_RX = re.compile(r"^---(.*)---", re.DOTALL | re.MULTILINE)
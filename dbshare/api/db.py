@@ -1,12 +1,12 @@
 "Database API endpoints."
 
 import http.client
-import io
 import sqlite3
 
 import flask
 import flask_cors
 
+import dbshare.columnar
 import dbshare.db
 import dbshare.query
 import dbshare.api.table
@@ -29,11 +29,15 @@ def database(dbname):
     """
     if utils.http_GET():
         try:
-            db = dbshare.db.get_check_read(dbname, nrows=True)
+            db = dbshare.db.get_check_read(dbname)
         except ValueError:
             flask.abort(http.client.UNAUTHORIZED)
         except KeyError:
             flask.abort(http.client.NOT_FOUND)
+        response = dbshare.db.check_not_modified(db)
+        if response is not None:
+            return response
+        dbshare.db.set_nrows(db, True)
         result = {
             "name": db["name"],
             "title": db.get("title"),
@@ -125,10 +129,9 @@ def database(dbname):
             flask.abort(http.client.UNSUPPORTED_MEDIA_TYPE)
         try:
             if add_func:
+                # The request body is read in chunks, not all at once.
                 db = add_func(
-                    dbname,
-                    io.BytesIO(flask.request.get_data()),
-                    flask.request.content_length,
+                    dbname, flask.request.stream, flask.request.content_length
                 )
             else:
                 with dbshare.db.DbSaver() as saver:
@@ -182,13 +185,20 @@ def database(dbname):
 
 @blueprint.route("/<name:dbname>/query", methods=["POST"])
 def query(dbname):
-    "Perform a query of the database; return rows."
+    """Perform a query of the database; return rows.
+    In Parquet or Arrow IPC file format instead of JSON, if preferred by
+    the header Accept; not acceptable if the package for these formats
+    is not installed.
+    """
     try:
         db = dbshare.db.get_check_read(dbname)
     except ValueError:
         flask.abort(http.client.UNAUTHORIZED)
     except KeyError:
         flask.abort(http.client.NOT_FOUND)
+    format = dbshare.columnar.accept_format()
+    if format and not dbshare.columnar.is_available():
+        flask.abort(http.client.NOT_ACCEPTABLE)
     timer = utils.Timer()
     try:
         query = flask.request.get_json()
@@ -200,6 +210,16 @@ def query(dbname):
     except SystemError:
         flask.abort(http.client.REQUEST_TIMEOUT)
     columns = [d[0] for d in cursor.description]
+    if format:
+        chunks = dbshare.columnar.stream_rows(
+            format,
+            [{"name": name} for name in columns],
+            utils.iter_timeout(dbcnx, cursor),
+        )
+        return flask.Response(
+            flask.stream_with_context(chunks),
+            mimetype=dbshare.columnar.FORMATS[format],
+        )
     rows = cursor.fetchall()
     result = {
         "query": query,
@@ -18,9 +18,14 @@ flask_cors.CORS(blueprint, methods=["GET"])
 @blueprint.route("/public")
 def public():
     "Return the list of public databases."
+    try:
+        dbs, next_args = dbshare.dbs.get_dbs_page(public=True)
+    except ValueError:
+        flask.abort(http.client.BAD_REQUEST)
     result = {
         "title": "Public databases",
-        "databases": get_json(dbshare.dbs.get_dbs(public=True)),
+        "databases": get_json(dbs),
+        "next": get_next_json(next_args),
     }
     return flask.jsonify(utils.get_json(**result))
 
@@ -29,11 +34,15 @@ def public():
 @utils.admin_required
 def all():
     "Return the list of all databases."
-    dbs = dbshare.dbs.get_dbs()
+    try:
+        dbs, next_args = dbshare.dbs.get_dbs_page()
+    except ValueError:
+        flask.abort(http.client.BAD_REQUEST)
     result = {
         "title": "All databases",
-        "total_size": sum([db["size"] for db in dbs]),
+        "total_size": dbshare.db.get_usage()[1],
         "databases": get_json(dbs),
+        "next": get_next_json(next_args),
     }
     return flask.jsonify(utils.get_json(**result))
 
@@ -44,12 +53,16 @@ def owner(username):
     "Return the list of databases owned by the given user."
     if not dbshare.dbs.has_access(username):
         return flask.abort(http.client.UNAUTHORIZED)
-    dbs = dbshare.dbs.get_dbs(owner=username)
+    try:
+        dbs, next_args = dbshare.dbs.get_dbs_page(owner=username)
+    except ValueError:
+        flask.abort(http.client.BAD_REQUEST)
     result = {
         "title": f"Databases owned by {username}",
         "user": dbshare.api.user.get_json(username),
-        "total_size": sum([db["size"] for db in dbs]),
+        "total_size": dbshare.db.get_usage(username)[1],
         "databases": get_json(dbs),
+        "next": get_next_json(next_args),
         "actions": [
             {
                 "title": "Create a new empty database.",
@@ -62,6 +75,13 @@ def owner(username):
     return flask.jsonify(utils.get_json(**result))
 
 
+def get_next_json(next_args):
+    "Return JSON for the link to the next page of databases, or None if none."
+    if next_args is None:
+        return None
+    return {"href": dbshare.dbs.get_next_url(next_args, external=True)}
+
+
 def get_json(dbs):
     "Return JSON for the databases."
     result = []
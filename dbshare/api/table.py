@@ -1,5 +1,6 @@
 "Table API endpoints."
 
+import functools
 import io
 import http.client
 import sqlite3
@@ -7,7 +8,9 @@ import sqlite3
 import flask
 import flask_cors
 
+import dbshare.columnar
 import dbshare.db
+import dbshare.exports
 import dbshare.table
 from dbshare import constants
 from dbshare import utils
@@ -35,6 +38,9 @@ def table(dbname, tablename):
             schema = db["tables"][tablename]
         except KeyError:
             flask.abort(http.client.NOT_FOUND)
+        response = dbshare.db.check_not_modified(db)
+        if response is not None:
+            return response
         result = get_json(db, schema, complete=True)
         result.update(schema)
         return flask.jsonify(utils.get_json(**result))
@@ -86,25 +92,68 @@ def rows_csv(dbname, tablename):
         schema = db["tables"][tablename]
     except KeyError:
         flask.abort(http.client.NOT_FOUND)
+    response = dbshare.db.check_not_modified(db)
+    if response is not None:
+        return response
+    try:
+        page = utils.get_page_args()
+    except ValueError as error:
+        utils.abort_json(http.client.BAD_REQUEST, error)
+    # Paged output is not cached, since the response depends on the page.
+    if page:
+        key = None
+    else:
+        key = dbshare.exports.get_key(
+            db, "csv", source=tablename, header=True, delimiter=",", rowid=False
+        )
+    infile = dbshare.exports.get(key)
+    if infile is not None:
+        return dbshare.exports.send(key, infile, constants.CSV_MIMETYPE)
     try:
         dbcnx = dbshare.db.get_cnx(dbname)
         columns = [c["name"] for c in schema["columns"]]
-        colnames = ",".join([f'"{c}"' for c in columns])
-        sql = f'SELECT {colnames} FROM "{tablename}"'
-        try:
+        if page:
+            rows, after = utils.get_rows_page(
+                dbcnx,
+                tablename,
+                columns,
+                page[1],
+                after=page[0],
+                keys=dbshare.db.get_row_keys(db, schema),
+            )
+        else:
+            colnames = ",".join([f'"{c}"' for c in columns])
+            sql = f'SELECT {colnames} FROM "{tablename}"'
             cursor = utils.execute_timeout(dbcnx, sql)
-        except SystemError:
-            flask.abort(http.client.REQUEST_TIMEOUT)
+            rows = utils.iter_timeout(dbcnx, cursor)
+    except ValueError as error:
+        utils.abort_json(http.client.BAD_REQUEST, error)
+    except SystemError:
+        flask.abort(http.client.REQUEST_TIMEOUT)
     except sqlite3.Error:
         flask.abort(http.client.INTERNAL_SERVER_ERROR)
     writer = utils.CsvWriter(header=columns)
-    writer.write_rows(cursor)
-    return flask.Response(writer.getvalue(), mimetype=constants.CSV_MIMETYPE)
+    chunks = dbshare.exports.store(key, writer.stream(rows))
+    response = flask.Response(
+        flask.stream_with_context(chunks), mimetype=constants.CSV_MIMETYPE
+    )
+    if page and after:
+        url = utils.url_for(
+            "api_table.rows_csv",
+            dbname=dbname,
+            tablename=tablename,
+            after=after,
+            limit=page[1],
+        )
+        response.headers["Link"] = f'<{url}>; rel="next"'
+    return response
 
 
 @blueprint.route("/<name:dbname>/<name:tablename>.json")
 def rows_json(dbname, tablename):
-    "Return the rows in JSON format."
+    """Return the rows in JSON format.
+    Newline-delimited JSON of only the rows, if preferred by the header Accept.
+    """
     try:
         db = dbshare.db.get_check_read(dbname)
     except ValueError:
@@ -115,15 +164,49 @@ def rows_json(dbname, tablename):
         schema = db["tables"][tablename]
     except KeyError:
         flask.abort(http.client.NOT_FOUND)
+    response = dbshare.db.check_not_modified(db)
+    if response is not None:
+        return response
+    try:
+        page = utils.get_page_args()
+    except ValueError as error:
+        utils.abort_json(http.client.BAD_REQUEST, error)
+    ndjson = utils.accept_ndjson()
+    mimetype = ndjson and constants.NDJSON_MIMETYPE or constants.JSON_MIMETYPE
+    # Paged output is not cached, since the response depends on the page.
+    # The URL is part of the output; the timestamp is left out if cached.
+    if page:
+        key = None
+    else:
+        key = dbshare.exports.get_key(
+            db, "json", source=tablename, ndjson=ndjson, url=flask.request.url
+        )
+    infile = dbshare.exports.get(key)
+    if infile is not None:
+        response = dbshare.exports.send(key, infile, mimetype)
+        response.vary.add("Accept")
+        return response
     try:
         dbcnx = dbshare.db.get_cnx(dbname)
         columns = [c["name"] for c in schema["columns"]]
-        colnames = ",".join([f'"{c}"' for c in columns])
-        sql = f'SELECT {colnames} FROM "{tablename}"'
-        try:
+        if page:
+            rows, after = utils.get_rows_page(
+                dbcnx,
+                tablename,
+                columns,
+                page[1],
+                after=page[0],
+                keys=dbshare.db.get_row_keys(db, schema),
+            )
+        else:
+            colnames = ",".join([f'"{c}"' for c in columns])
+            sql = f'SELECT {colnames} FROM "{tablename}"'
             cursor = utils.execute_timeout(dbcnx, sql)
-        except SystemError:
-            flask.abort(http.client.REQUEST_TIMEOUT)
+            rows = utils.iter_timeout(dbcnx, cursor)
+    except ValueError as error:
+        utils.abort_json(http.client.BAD_REQUEST, error)
+    except SystemError:
+        flask.abort(http.client.REQUEST_TIMEOUT)
     except sqlite3.Error:
         flask.abort(http.client.INTERNAL_SERVER_ERROR)
     result = {
@@ -136,9 +219,118 @@ def rows_json(dbname, tablename):
             ),
         },
         "nrows": schema["nrows"],
-        "data": [dict(zip(columns, row)) for row in cursor],
     }
-    return flask.jsonify(utils.get_json(**result))
+    if page:
+        if after:
+            url = utils.url_for(
+                "api_table.rows_json",
+                dbname=dbname,
+                tablename=tablename,
+                after=after,
+                limit=page[1],
+            )
+            result["next"] = {"href": url}
+        else:
+            result["next"] = None
+    result = utils.get_json(**result)
+    if key is not None:
+        # The cached output is served later; its timestamp would be stale.
+        result.pop("timestamp")
+    chunks = utils.stream_json_rows(result, columns, rows, ndjson=ndjson)
+    chunks = dbshare.exports.store(key, chunks)
+    response = flask.Response(flask.stream_with_context(chunks), mimetype=mimetype)
+    response.vary.add("Accept")
+    if page and after:
+        response.headers["Link"] = f'<{url}>; rel="next"'
+    return response
+
+
+@blueprint.route(
+    "/<name:dbname>/<name:tablename>.parquet", defaults={"format": "parquet"}
+)
+@blueprint.route("/<name:dbname>/<name:tablename>.arrow", defaults={"format": "arrow"})
+def rows_columnar(dbname, tablename, format):
+    """Return the rows in Parquet or Arrow IPC file format.
+    Not acceptable if the package for these formats is not installed.
+    """
+    if not dbshare.columnar.is_available():
+        flask.abort(http.client.NOT_ACCEPTABLE)
+    try:
+        db = dbshare.db.get_check_read(dbname)
+    except ValueError:
+        flask.abort(http.client.UNAUTHORIZED)
+    except KeyError:
+        flask.abort(http.client.NOT_FOUND)
+    try:
+        schema = db["tables"][tablename]
+    except KeyError:
+        flask.abort(http.client.NOT_FOUND)
+    response = dbshare.db.check_not_modified(db)
+    if response is not None:
+        return response
+    try:
+        page = utils.get_page_args()
+    except ValueError as error:
+        utils.abort_json(http.client.BAD_REQUEST, error)
+    # Paged output is not cached, since the response depends on the page.
+    key = None if page else dbshare.exports.get_key(db, format, source=tablename)
+    infile = dbshare.exports.get(key)
+    if infile is not None:
+        return dbshare.exports.send(
+            key,
+            infile,
+            dbshare.columnar.FORMATS[format],
+            filename=f"{tablename}.{format}",
+        )
+    try:
+        dbcnx = dbshare.db.get_cnx(dbname)
+        columns = [c["name"] for c in schema["columns"]]
+        if page:
+            rows, after = utils.get_rows_page(
+                dbcnx,
+                tablename,
+                columns,
+                page[1],
+                after=page[0],
+                keys=dbshare.db.get_row_keys(db, schema),
+            )
+            checked = dbshare.columnar.check_columns_rows(schema["columns"], rows)
+        else:
+            colnames = ",".join([f'"{c}"' for c in columns])
+            sql = f'SELECT {colnames} FROM "{tablename}"'
+            cursor = utils.execute_timeout(dbcnx, sql)
+            rows = utils.iter_timeout(dbcnx, cursor)
+            # Check the types of the values when the output begins; this
+            # scans all rows, so it is limited by the stream time-out.
+            checked = functools.partial(
+                dbshare.columnar.check_columns, dbcnx, tablename, schema["columns"]
+            )
+    except ValueError as error:
+        utils.abort_json(http.client.BAD_REQUEST, error)
+    except SystemError:
+        flask.abort(http.client.REQUEST_TIMEOUT)
+    except sqlite3.Error:
+        flask.abort(http.client.INTERNAL_SERVER_ERROR)
+    chunks = dbshare.columnar.stream_rows(format, checked, rows)
+    chunks = dbshare.exports.store(key, chunks)
+    response = flask.Response(
+        flask.stream_with_context(chunks),
+        mimetype=dbshare.columnar.FORMATS[format],
+    )
+    response.headers.set(
+        "Content-Disposition", "attachment", filename=f"{tablename}.{format}"
+    )
+    if page and after:
+        url = utils.url_for(
+            "api_table.rows_columnar",
+            dbname=dbname,
+            tablename=tablename,
+            format=format,
+            after=after,
+            limit=page[1],
+        )
+        response.headers["Link"] = f'<{url}>; rel="next"'
+    return response
 
 
 @blueprint.route("/<name:dbname>/<name:tablename>/statistics", methods=["GET"])
@@ -1,11 +1,15 @@
 "View API endpoints."
 
+import functools
 import http.client
+import sqlite3
 
 import flask
 import flask_cors
 
+import dbshare.columnar
 import dbshare.db
+import dbshare.exports
 from dbshare import constants
 from dbshare import utils
 
@@ -23,7 +27,7 @@ def view(dbname, viewname):
     """
     if utils.http_GET():
         try:
-            db = dbshare.db.get_check_read(dbname, nrows=[viewname])
+            db = dbshare.db.get_check_read(dbname)
         except ValueError:
             flask.abort(http.client.UNAUTHORIZED)
         except KeyError:
@@ -32,6 +36,10 @@ def view(dbname, viewname):
             schema = db["views"][viewname]
         except KeyError:
             flask.abort(http.client.NOT_FOUND)
+        response = dbshare.db.check_not_modified(db)
+        if response is not None:
+            return response
+        dbshare.db.set_nrows(db, [viewname])
         result = get_json(db, schema, complete=True)
         result.update(schema)
         result.pop("type", None)
@@ -72,7 +80,7 @@ def view(dbname, viewname):
 def rows_csv(dbname, viewname):
     "Return the rows in CSV format."
     try:
-        db = dbshare.db.get_check_read(dbname, nrows=[viewname])
+        db = dbshare.db.get_check_read(dbname)
     except ValueError:
         flask.abort(http.client.UNAUTHORIZED)
     except KeyError:
@@ -81,27 +89,70 @@ def rows_csv(dbname, viewname):
         schema = db["views"][viewname]
     except KeyError:
         flask.abort(http.client.NOT_FOUND)
+    response = dbshare.db.check_not_modified(db)
+    if response is not None:
+        return response
+    try:
+        page = utils.get_page_args()
+    except ValueError as error:
+        utils.abort_json(http.client.BAD_REQUEST, error)
+    # Paged output is not cached, since the response depends on the page.
+    if page:
+        key = None
+    else:
+        key = dbshare.exports.get_key(
+            db, "csv", source=viewname, header=True, delimiter=","
+        )
+    infile = dbshare.exports.get(key)
+    if infile is not None:
+        return dbshare.exports.send(key, infile, constants.CSV_MIMETYPE)
     try:
         dbcnx = dbshare.db.get_cnx(dbname)
         columns = [c["name"] for c in schema["columns"]]
-        colnames = ",".join([f'"{c}"' for c in columns])
-        sql = f'SELECT {colnames} FROM "{viewname}"'
-        try:
+        if page:
+            rows, after = utils.get_rows_page(
+                dbcnx,
+                viewname,
+                columns,
+                page[1],
+                after=page[0],
+                keys=dbshare.db.get_row_keys(db, schema),
+            )
+        else:
+            colnames = ",".join([f'"{c}"' for c in columns])
+            sql = f'SELECT {colnames} FROM "{viewname}"'
             cursor = utils.execute_timeout(dbcnx, sql)
-        except SystemError:
-            flask.abort(http.client.REQUEST_TIMEOUT)
+            rows = utils.iter_timeout(dbcnx, cursor)
+    except ValueError as error:
+        utils.abort_json(http.client.BAD_REQUEST, error)
+    except SystemError:
+        flask.abort(http.client.REQUEST_TIMEOUT)
     except sqlite3.Error:
         flask.abort(http.client.INTERNAL_SERVER_ERROR)
     writer = utils.CsvWriter(header=columns)
-    writer.write_rows(cursor)
-    return flask.Response(writer.getvalue(), mimetype=constants.CSV_MIMETYPE)
+    chunks = dbshare.exports.store(key, writer.stream(rows))
+    response = flask.Response(
+        flask.stream_with_context(chunks), mimetype=constants.CSV_MIMETYPE
+    )
+    if page and after:
+        url = utils.url_for(
+            "api_view.rows_csv",
+            dbname=dbname,
+            viewname=viewname,
+            after=after,
+            limit=page[1],
+        )
+        response.headers["Link"] = f'<{url}>; rel="next"'
+    return response
 
 
 @blueprint.route("/<name:dbname>/<name:viewname>.json")
 def rows_json(dbname, viewname):
-    "Return the rows in JSON format."
+    """Return the rows in JSON format.
+    Newline-delimited JSON of only the rows, if preferred by the header Accept.
+    """
     try:
-        db = dbshare.db.get_check_read(dbname, nrows=[viewname])
+        db = dbshare.db.get_check_read(dbname)
     except ValueError:
         flask.abort(http.client.UNAUTHORIZED)
     except KeyError:
@@ -110,15 +161,50 @@ def rows_json(dbname, viewname):
         schema = db["views"][viewname]
     except KeyError:
         flask.abort(http.client.NOT_FOUND)
+    response = dbshare.db.check_not_modified(db)
+    if response is not None:
+        return response
+    dbshare.db.set_nrows(db, [viewname])
+    try:
+        page = utils.get_page_args()
+    except ValueError as error:
+        utils.abort_json(http.client.BAD_REQUEST, error)
+    ndjson = utils.accept_ndjson()
+    mimetype = ndjson and constants.NDJSON_MIMETYPE or constants.JSON_MIMETYPE
+    # Paged output is not cached, since the response depends on the page.
+    # The URL is part of the output; the timestamp is left out if cached.
+    if page:
+        key = None
+    else:
+        key = dbshare.exports.get_key(
+            db, "json", source=viewname, ndjson=ndjson, url=flask.request.url
+        )
+    infile = dbshare.exports.get(key)
+    if infile is not None:
+        response = dbshare.exports.send(key, infile, mimetype)
+        response.vary.add("Accept")
+        return response
     try:
         dbcnx = dbshare.db.get_cnx(dbname)
         columns = [c["name"] for c in schema["columns"]]
-        colnames = ",".join([f'"{c}"' for c in columns])
-        sql = f'SELECT {colnames} FROM "{viewname}"'
-        try:
+        if page:
+            rows, after = utils.get_rows_page(
+                dbcnx,
+                viewname,
+                columns,
+                page[1],
+                after=page[0],
+                keys=dbshare.db.get_row_keys(db, schema),
+            )
+        else:
+            colnames = ",".join([f'"{c}"' for c in columns])
+            sql = f'SELECT {colnames} FROM "{viewname}"'
             cursor = utils.execute_timeout(dbcnx, sql)
-        except SystemError:
-            flask.abort(http.client.REQUEST_TIMEOUT)
+            rows = utils.iter_timeout(dbcnx, cursor)
+    except ValueError as error:
+        utils.abort_json(http.client.BAD_REQUEST, error)
+    except SystemError:
+        flask.abort(http.client.REQUEST_TIMEOUT)
     except sqlite3.Error:
         flask.abort(http.client.INTERNAL_SERVER_ERROR)
     result = {
@@ -131,9 +217,30 @@ def rows_json(dbname, viewname):
             ),
         },
         "nrows": schema["nrows"],
-        "data": [dict(zip(columns, row)) for row in cursor],
     }
-    return flask.jsonify(utils.get_json(**result))
+    if page:
+        if after:
+            url = utils.url_for(
+                "api_view.rows_json",
+                dbname=dbname,
+                viewname=viewname,
+                after=after,
+                limit=page[1],
+            )
+            result["next"] = {"href": url}
+        else:
+            result["next"] = None
+    result = utils.get_json(**result)
+    if key is not None:
+        # The cached output is served later; its timestamp would be stale.
+        result.pop("timestamp")
+    chunks = utils.stream_json_rows(result, columns, rows, ndjson=ndjson)
+    chunks = dbshare.exports.store(key, chunks)
+    response = flask.Response(flask.stream_with_context(chunks), mimetype=mimetype)
+    response.vary.add("Accept")
+    if page and after:
+        response.headers["Link"] = f'<{url}>; rel="next"'
+    return response
 
 
 def get_json(db, view, complete=False, title=False):
@@ -172,3 +279,91 @@ def get_json(db, view, complete=False, title=False):
             "api_view.view", dbname=db["name"], viewname=view["name"]
         )
     return result
+
+
+@blueprint.route(
+    "/<name:dbname>/<name:viewname>.parquet", defaults={"format": "parquet"}
+)
+@blueprint.route("/<name:dbname>/<name:viewname>.arrow", defaults={"format": "arrow"})
+def rows_columnar(dbname, viewname, format):
+    """Return the rows in Parquet or Arrow IPC file format.
+    Not acceptable if the package for these formats is not installed.
+    """
+    if not dbshare.columnar.is_available():
+        flask.abort(http.client.NOT_ACCEPTABLE)
+    try:
+        db = dbshare.db.get_check_read(dbname)
+    except ValueError:
+        flask.abort(http.client.UNAUTHORIZED)
+    except KeyError:
+        flask.abort(http.client.NOT_FOUND)
+    try:
+        schema = db["views"][viewname]
+    except KeyError:
+        flask.abort(http.client.NOT_FOUND)
+    response = dbshare.db.check_not_modified(db)
+    if response is not None:
+        return response
+    try:
+        page = utils.get_page_args()
+    except ValueError as error:
+        utils.abort_json(http.client.BAD_REQUEST, error)
+    # Paged output is not cached, since the response depends on the page.
+    key = None if page else dbshare.exports.get_key(db, format, source=viewname)
+    infile = dbshare.exports.get(key)
+    if infile is not None:
+        return dbshare.exports.send(
+            key,
+            infile,
+            dbshare.columnar.FORMATS[format],
+            filename=f"{viewname}.{format}",
+        )
+    try:
+        dbcnx = dbshare.db.get_cnx(dbname)
+        columns = [c["name"] for c in schema["columns"]]
+        if page:
+            rows, after = utils.get_rows_page(
+                dbcnx,
+                viewname,
+                columns,
+                page[1],
+                after=page[0],
+                keys=dbshare.db.get_row_keys(db, schema),
+            )
+            checked = dbshare.columnar.check_columns_rows(schema["columns"], rows)
+        else:
+            colnames = ",".join([f'"{c}"' for c in columns])
+            sql = f'SELECT {colnames} FROM "{viewname}"'
+            cursor = utils.execute_timeout(dbcnx, sql)
+            rows = utils.iter_timeout(dbcnx, cursor)
+            # Check the types of the values when the output begins; this
+            # scans all rows, so it is limited by the stream time-out.
+            checked = functools.partial(
+                dbshare.columnar.check_columns, dbcnx, viewname, schema["columns"]
+            )
+    except ValueError as error:
+        utils.abort_json(http.client.BAD_REQUEST, error)
+    except SystemError:
+        flask.abort(http.client.REQUEST_TIMEOUT)
+    except sqlite3.Error:
+        flask.abort(http.client.INTERNAL_SERVER_ERROR)
+    chunks = dbshare.columnar.stream_rows(format, checked, rows)
+    chunks = dbshare.exports.store(key, chunks)
+    response = flask.Response(
+        flask.stream_with_context(chunks),
+        mimetype=dbshare.columnar.FORMATS[format],
+    )
+    response.headers.set(
+        "Content-Disposition", "attachment", filename=f"{viewname}.{format}"
+    )
+    if page and after:
+        url = utils.url_for(
+            "api_view.rows_columnar",
+            dbname=dbname,
+            viewname=viewname,
+            format=format,
+            after=after,
+            limit=page[1],
+        )
+        response.headers["Link"] = f'<{url}>; rel="next"'
+    return response
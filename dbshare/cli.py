@@ -2,6 +2,7 @@
 
 import json
 import os.path
+import sqlite3
 import tarfile
 import time
 
@@ -9,7 +10,9 @@ import click
 import flask
 
 import dbshare.main
+import dbshare.db
 import dbshare.dbs
+import dbshare.pool
 import dbshare.api.db
 import dbshare.system
 import dbshare.user
@@ -174,6 +177,82 @@ def db(name):
         )
 
 
+@cli.command()
+def sizes():
+    """Reconcile the recorded sizes of the databases with their files.
+    Output the databases for which the recorded size was wrong,
+    and those whose file is missing.
+    """
+    with dbshare.main.app.app_context():
+        flask.g.syscnx = utils.get_cnx()
+        sql = "SELECT name, size FROM dbs"
+        for name, size in flask.g.syscnx.execute(sql).fetchall():
+            try:
+                actual = dbshare.db.get_file_size(name)
+            except OSError as error:
+                click.echo(f"{name}: cannot access file; {error.strerror}")
+                continue
+            if actual != size:
+                dbshare.db.update_size(name)
+                click.echo(f"{name}: {size} -> {actual}")
+
+
+@cli.command()
+@click.argument("dbnames", nargs=-1)
+@click.option(
+    "-p",
+    "--profile",
+    type=str,
+    default=None,
+    help="Set this PRAGMA profile for the databases; 'default' to unset.",
+)
+def convert(dbnames, profile):
+    """Checkpoint and convert the database files to their PRAGMA profiles.
+    All databases, if none are named; the system database is then also
+    checkpointed, and returned to a rollback journal if needed.
+    Best done when the instance is not busy; the journal mode
+    cannot be changed while other connections are open.
+    """
+    with dbshare.main.app.app_context():
+        config = flask.current_app.config
+        flask.g.syscnx = utils.get_cnx()
+        if dbnames:
+            dbs = [dbshare.db.get_db(name) for name in dbnames]
+            if None in dbs:
+                raise click.ClickException("No such database.")
+        else:
+            dbs = dbshare.dbs.get_dbs()
+        for db in dbs:
+            if db["readonly"]:
+                click.echo(f"{db['name']}: read-only; skipped")
+                continue
+            if profile:
+                try:
+                    with dbshare.db.DbSaver(db) as saver:
+                        saver.set_profile(None if profile == "default" else profile)
+                except ValueError as error:
+                    raise click.ClickException(str(error))
+            pragmas = config["PRAGMA_PROFILES"].get(db["profile"])
+            if pragmas is None:
+                pragmas = config["PRAGMA_PROFILES"][config["PRAGMA_PROFILE"]]
+            cnx = dbshare.db.get_cnx(db["name"], write=True)
+            cnx.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            journal_mode = pragmas.get("journal_mode")
+            if journal_mode:
+                journal_mode = utils.set_journal_mode(cnx, journal_mode, wait=True)
+            click.echo(f"{db['name']}: {db['profile'] or 'default'}, {journal_mode}")
+        if not dbnames:
+            # The PRAGMA profiles apply only to user databases. Changing
+            # the journal mode requires closing all system connections.
+            utils.release_cnxs()
+            dbshare.pool.invalidate(constants.SYSTEM)
+            cnx = sqlite3.connect(utils.get_dbpath(constants.SYSTEM))
+            cnx.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            journal_mode = utils.set_journal_mode(cnx, "DELETE", wait=True)
+            cnx.close()
+            click.echo(f"{constants.SYSTEM}: {journal_mode}")
+
+
 @cli.command()
 @click.option("-f",
               "--filepath",
@@ -193,6 +272,11 @@ def dump(filepath, dumpdir):
     with dbshare.main.app.app_context():
         flask.g.syscnx = utils.get_cnx()
         dbs = dbshare.dbs.get_dbs()
+        # Move the contents of any write-ahead logs into the database files.
+        utils.get_cnx(write=True).execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        for db in dbs:
+            if not db["readonly"]:
+                dbshare.db.checkpoint(db["name"])
         flask.g.syscnx.close()
         del flask.g.syscnx
         if filepath.endswith(".gz"):
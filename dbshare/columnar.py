@@ -0,0 +1,231 @@
+"""Output of rows in the columnar Parquet and Arrow IPC file formats.
+Requires the optional package 'pyarrow'.
+"""
+
+import flask
+
+try:
+    import pyarrow
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+from dbshare import constants
+from dbshare import utils
+
+
+# Format name (also the extension of the URL) -> MIME type.
+FORMATS = {
+    "parquet": constants.PARQUET_MIMETYPE,
+    "arrow": constants.ARROW_MIMETYPE,
+}
+
+# Sqlite3 value type (as given by 'typeof') -> column type.
+VALUE_TYPES = {
+    "integer": constants.INTEGER,
+    "real": constants.REAL,
+    "text": constants.TEXT,
+    "blob": constants.BLOB,
+}
+
+# Column type -> the value types that it can hold in the columnar formats.
+COMPATIBLE_TYPES = {
+    constants.INTEGER: {constants.INTEGER},
+    constants.REAL: {constants.INTEGER, constants.REAL},
+    constants.TEXT: {constants.TEXT},
+    constants.BLOB: {constants.BLOB},
+}
+
+
+def is_available():
+    "Is the package required for the columnar formats installed?"
+    return pyarrow is not None
+
+
+def accept_format():
+    """Return the columnar format name if its MIME type is preferred
+    over JSON by the header Accept, else None.
+    """
+    acc = flask.request.accept_mimetypes
+    best = acc.best_match(list(FORMATS.values()) + [constants.JSON_MIMETYPE])
+    for format, mimetype in FORMATS.items():
+        if best == mimetype and acc[best] > acc[constants.JSON_MIMETYPE]:
+            return format
+    return None
+
+
+def get_type(coltype):
+    "Return the Arrow data type for the Sqlite3 column type, or None."
+    return {
+        constants.INTEGER: pyarrow.int64(),
+        constants.REAL: pyarrow.float64(),
+        constants.TEXT: pyarrow.string(),
+        constants.BLOB: pyarrow.binary(),
+    }.get(coltype)
+
+
+def check_columns(cnx, sourcename, columns):
+    """Return the columns of the table or view with the types of the values
+    actually in them, which Sqlite3 allows to differ from the declared types.
+    This requires a scan of the table or view, but ensures that the output
+    of its rows does not fail on a value of another type once it has begun.
+    The scan is part of the output, so it is limited by STREAM_TIMEOUT.
+    Raise SystemError if interrupted by time-out.
+    """
+    items = []
+    for column in columns:
+        for valuetype in VALUE_TYPES:
+            items.append(f"""MAX(typeof("{column['name']}")='{valuetype}')""")
+    sql = f'SELECT {",".join(items)} FROM "{sourcename}"'
+    timeout = flask.current_app.config["STREAM_TIMEOUT"]
+    flags = utils.execute_timeout(cnx, sql, timeout=timeout).fetchone()
+    found = []
+    for pos in range(0, len(flags), len(VALUE_TYPES)):
+        found.append({t for t, f in zip(VALUE_TYPES.values(), flags[pos:]) if f})
+    return _get_checked_columns(columns, found)
+
+
+def check_columns_rows(columns, rows):
+    "Return the columns with the types of the values in the given rows."
+    found = [set() for column in columns]
+    for row in rows:
+        for types, value in zip(found, row):
+            if isinstance(value, int):
+                types.add(constants.INTEGER)
+            elif isinstance(value, float):
+                types.add(constants.REAL)
+            elif isinstance(value, bytes):
+                types.add(constants.BLOB)
+            elif value is not None:
+                types.add(constants.TEXT)
+    return _get_checked_columns(columns, found)
+
+
+def _get_checked_columns(columns, found):
+    """Return the columns with types that can hold the types of the values
+    found in them. The declared type is kept if it can; else integer and
+    real values give a real column, and any other mix a text column.
+    """
+    result = []
+    for column, types in zip(columns, found):
+        coltype = column.get("type")
+        if types and not types.issubset(COMPATIBLE_TYPES.get(coltype, set())):
+            if types == {constants.INTEGER}:
+                coltype = constants.INTEGER
+            elif types.issubset(COMPATIBLE_TYPES[constants.REAL]):
+                coltype = constants.REAL
+            elif len(types) == 1:
+                coltype = types.pop()
+            else:
+                coltype = constants.TEXT
+        result.append({**column, "type": coltype})
+    return result
+
+
+def stream_rows(format, columns, rows, batch_size=None):
+    """Yield the chunks of the file in the given columnar format
+    containing the rows. The 'columns' is a list of column dictionaries,
+    or a callable returning it, which is called when the output begins.
+    The Arrow data types are obtained from their 'type' items, which
+    should be checked against the values by 'check_columns'. A column
+    without a type gets the type of its values in the first batch of rows
+    only, so that a later value of another type fails. The rows are
+    converted in batches of 'batch_size' rows, by default
+    COLUMNAR_BATCH_SIZE; each is a row group in the Parquet file, or a
+    record batch in the Arrow IPC file.
+    Raise ValueError if a value cannot be converted to its column's type.
+    If this happens after the first chunk, it is logged, and the output
+    is aborted without the end of the file.
+    """
+    if batch_size is None:
+        batch_size = flask.current_app.config["COLUMNAR_BATCH_SIZE"]
+    if callable(columns):
+        columns = columns()
+    sink = _Sink()
+    writer = None
+    batch = []
+    rows = iter(rows)
+    while True:
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= batch_size:
+                break
+        if writer is None:
+            schema = _get_schema(columns, batch)
+            if format == "parquet":
+                writer = pyarrow.parquet.ParquetWriter(sink, schema)
+            elif format == "arrow":
+                writer = pyarrow.ipc.new_file(sink, schema)
+            else:
+                raise ValueError(f"invalid columnar format '{format}'")
+        if batch:
+            try:
+                table = _get_table(schema, batch)
+            except ValueError as error:
+                if sink.started:
+                    # The response has begun; re-raising aborts it without
+                    # the end of the chunked transfer, and the file lacks
+                    # its footer, so that it cannot be taken as complete.
+                    flask.current_app.logger.error(f"Columnar output aborted: {error}")
+                raise
+            writer.write_table(table)
+            yield sink.flush_chunks()
+        if len(batch) < batch_size:
+            break
+        batch = []
+    writer.close()
+    yield sink.flush_chunks()
+
+
+def _get_schema(columns, rows):
+    """Return the Arrow schema for the columns. A column without a type
+    gets the type of its values in the rows, by default the string type.
+    """
+    fields = []
+    for column, checked in zip(columns, check_columns_rows(columns, rows)):
+        datatype = get_type(column.get("type")) or get_type(checked["type"])
+        fields.append(pyarrow.field(column["name"], datatype or pyarrow.string()))
+    return pyarrow.schema(fields)
+
+
+def _get_table(schema, rows):
+    "Return the Arrow table for the rows, converting values as needed."
+    arrays = []
+    for pos, field in enumerate(schema):
+        values = [row[pos] for row in rows]
+        try:
+            arrays.append(pyarrow.array(values, type=field.type))
+        except (pyarrow.ArrowInvalid, pyarrow.ArrowTypeError):
+            # Sqlite3 allows values of other types than the declared one.
+            if field.type != pyarrow.string():
+                raise ValueError(f"value not of the type of column '{field.name}'")
+            values = [None if v is None else str(v) for v in values]
+            arrays.append(pyarrow.array(values, type=field.type))
+    return pyarrow.Table.from_arrays(arrays, schema=schema)
+
+
+class _Sink:
+    "File-like object collecting the output of a writer, for streaming it."
+
+    def __init__(self):
+        self.chunks = []
+        self.closed = False
+        self.started = False
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def flush_chunks(self):
+        "Return the data written so far, and discard it."
+        result = b"".join(self.chunks)
+        self.chunks = []
+        self.started = True
+        return result
@@ -0,0 +1,166 @@
+"""Compression of responses according to the header Accept-Encoding.
+Encodings 'zstd' and 'br' require the optional packages 'zstandard'
+and 'brotli', respectively; 'gzip' is always available.
+"""
+
+import http.client
+import zlib
+
+import flask
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+from dbshare import constants
+
+
+# In order of preference when the client accepts several equally.
+ENCODINGS = ["zstd", "br", "gzip"]
+
+# The file extension of the encodings, for precompressed files.
+EXTENSIONS = {"zstd": "zst", "br": "br", "gzip": "gz"}
+
+# Responses of other types are either small or already compressed.
+COMPRESSIBLE_MIMETYPES = set(
+    [constants.CSV_MIMETYPE, constants.JSON_MIMETYPE, constants.NDJSON_MIMETYPE]
+)
+
+
+def is_available(encoding):
+    "Is the package required for the encoding installed?"
+    if encoding == "zstd":
+        return zstandard is not None
+    elif encoding == "br":
+        return brotli is not None
+    else:
+        return encoding == "gzip"
+
+
+def is_compressible(mimetype):
+    "Is a response of the MIME type to be compressed?"
+    return mimetype in COMPRESSIBLE_MIMETYPES
+
+
+def get_encoding(mimetype, size=None):
+    """Return the encoding to use for a response of the given MIME type
+    and size, if known, or None if it is to be sent uncompressed.
+    The encodings are those configured in COMPRESSION_LEVELS which are
+    available, and the client accepts.
+    """
+    if not is_compressible(mimetype):
+        return None
+    config = flask.current_app.config
+    if size is not None and size < config["COMPRESSION_MIN_SIZE"]:
+        return None
+    encodings = [
+        e for e in ENCODINGS if e in config["COMPRESSION_LEVELS"] and is_available(e)
+    ]
+    acc = flask.request.accept_encodings
+    best = acc.best_match(encodings)
+    if best is None or not acc[best]:
+        return None
+    return best
+
+
+def compress(encoding, chunks, level=None):
+    """Yield the given chunks compressed by the encoding, incrementally.
+    The level is by default the one configured in COMPRESSION_LEVELS.
+    """
+    if level is None:
+        level = flask.current_app.config["COMPRESSION_LEVELS"][encoding]
+    if encoding == "gzip":
+        compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+        process, finish = compressor.compress, compressor.flush
+    elif encoding == "zstd":
+        compressor = zstandard.ZstdCompressor(level=level).compressobj()
+        process, finish = compressor.compress, compressor.flush
+    elif encoding == "br":
+        compressor = brotli.Compressor(quality=level)
+        process, finish = compressor.process, compressor.finish
+    else:
+        raise ValueError(f"invalid encoding '{encoding}'")
+    try:
+        for chunk in chunks:
+            data = process(_get_bytes(chunk))
+            if data:
+                yield data
+        yield finish()
+    finally:
+        # Let the source, e.g. a streamed response, clean up if interrupted.
+        if hasattr(chunks, "close"):
+            chunks.close()
+
+
+def set_encoding(response, encoding):
+    "Set the headers of the response for the encoding, if any."
+    response.vary.add("Accept-Encoding")
+    if encoding:
+        response.content_encoding = encoding
+        response.headers.pop("Content-Length", None)
+
+
+def compress_response(response):
+    """Compress the response, if of a suitable type and large enough,
+    and the client accepts it. A streamed response is compressed as
+    it is being sent; the chunks needed to decide on its size are read
+    beforehand. Responses sending files, directly or by the reverse proxy,
+    and those already encoded are not modified, except for the header Vary.
+    """
+    if not is_compressible(response.mimetype):
+        return response
+    if response.status_code != http.client.OK or response.content_encoding:
+        response.vary.add("Accept-Encoding")
+        return response
+    if response.direct_passthrough or "X-Accel-Redirect" in response.headers:
+        set_encoding(response, None)
+        return response
+    if response.is_streamed:
+        min_size = flask.current_app.config["COMPRESSION_MIN_SIZE"]
+        chunks = iter(response.response)
+        head = []
+        size = 0
+        for chunk in chunks:
+            head.append(chunk)
+            size += len(chunk)
+            if size >= min_size:
+                break
+        else:  # All of it has been read; send it as a whole.
+            response.set_data(b"".join(_get_bytes(c) for c in head))
+            return compress_response(response)
+        encoding = get_encoding(response.mimetype)
+        set_encoding(response, encoding)
+        chunks = _chain(head, chunks, response.response)
+        if encoding:
+            response.response = compress(encoding, chunks)
+        else:
+            response.response = chunks
+    else:
+        data = response.get_data()
+        encoding = get_encoding(response.mimetype, len(data))
+        set_encoding(response, encoding)
+        if encoding:
+            response.set_data(b"".join(compress(encoding, [data])))
+    return response
+
+
+def _get_bytes(chunk):
+    "Return the chunk of a response as bytes."
+    if isinstance(chunk, str):
+        return chunk.encode("utf-8")
+    return chunk
+
+
+def _chain(head, chunks, source):
+    "Yield the chunks read beforehand, then the rest; close the source."
+    try:
+        yield from head
+        yield from chunks
+    finally:
+        if hasattr(source, "close"):
+            source.close()
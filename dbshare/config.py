@@ -27,24 +27,65 @@ DEFAULT_SETTINGS = dict(
     MIN_PASSWORD_LENGTH=6,
     PERMANENT_SESSION_LIFETIME=7 * 24 * 60 * 60,  # In seconds; = 1 week.
     USER_DEFAULT_QUOTA=2 ** 27,  # = 134 megabytes.
+    USER_CACHE_TTL=10.0,  # Seconds a looked-up user is cached; 0 disables.
     TABLE_INITIAL_COLUMNS=8,
     MAX_NROWS_DISPLAY=2000,
+    ROWS_DISPLAY_PAGE_SIZE=100,  # Default number of rows per page in HTML.
+    DBS_PAGE_SIZE=100,  # Default number of databases per page in lists.
+    ROWS_PAGE_SIZE=1000,  # Default number of rows per page in the API.
     CONTENT_HASHES=["md5", "sha1"],
+    PUBLIC_CACHE_MAX_AGE=3600,  # Seconds proxies may cache public read-only data.
     QUERY_DEFAULT_LIMIT=200,
     DOCUMENTATION_DIR=os.path.join(constants.ROOT, "documentation"),
-    # Suggested values for timeout, increment and backoff.
-    # t=2.0, i=0.010, b=1.75
-    #        i=0.014, b=1.55
-    #        i=0.022, b=1.55
-    # t=3.0, i=0.012, b=1.50
-    #        i=0.014, b=1.95
-    #        i=0.022, b=1.80
-    # t=4.0, i=0.010, b=1.45
-    #        i=0.014, b=1.70
-    #        i=0.020, b=1.75
-    EXECUTE_TIMEOUT=2.0,
-    EXECUTE_TIMEOUT_INCREMENT=0.010,
-    EXECUTE_TIMEOUT_BACKOFF=1.75,
+    CNX_POOL_MAX_SIZE=32,  # Max number of idle connections kept per process.
+    CNX_POOL_MAX_IDLE=300.0,  # Seconds before an idle connection is closed.
+    METADATA_CACHE_SIZE=128,  # Max number of databases with cached metadata.
+    IMMUTABLE_MMAP_SIZE=2 ** 28,  # Bytes memory-mapped for read-only databases.
+    # PRAGMAs applied when opening a connection to a user database (not the
+    # system database); 'journal_mode' for write connections only.
+    PRAGMA_PROFILES={
+        "wal-fast": {
+            "journal_mode": "WAL",
+            "synchronous": "NORMAL",
+            "cache_size": -65536,  # Negative: in kilobytes.
+            "temp_store": "MEMORY",
+        },
+        "durable": {
+            "journal_mode": "DELETE",
+            "synchronous": "FULL",
+            "cache_size": -16384,
+            "temp_store": "DEFAULT",
+        },
+        "bulk-load": {
+            "journal_mode": "WAL",
+            "synchronous": "OFF",
+            "cache_size": -262144,
+            "temp_store": "MEMORY",
+        },
+    },
+    PRAGMA_PROFILE="wal-fast",  # Default; a database may override in 'dbs'.
+    EXECUTE_TIMEOUT=2.0,  # Seconds; default for query execution.
+    EXECUTE_TIMEOUT_ROLES={},  # Role -> seconds; overrides the default.
+    EXECUTE_TIMEOUT_USERS={},  # Username -> seconds; overrides role and default.
+    EXECUTE_TIMEOUT_INSTRUCTIONS=1000,  # Sqlite3 VM instructions between checks.
+    STREAM_TIMEOUT=600.0,  # Seconds; max time for streaming output of rows.
+    STREAM_CHUNK_SIZE=2 ** 16,  # Approximate size of chunks of streamed output.
+    STREAM_BATCH_SIZE=1000,  # Number of rows fetched at a time for streaming.
+    COLUMNAR_BATCH_SIZE=2 ** 16,  # Number of rows per Parquet row group.
+    EXPORT_WORKERS=4,  # Number of threads producing the files for an export.
+    EXPORT_SPOOL_SIZE=2 ** 22,  # Bytes of an export file kept in memory.
+    EXPORT_CACHE_DIR=None,  # Default: subdirectory '_exports' of DATABASES_DIR.
+    EXPORT_CACHE_MAX_SIZE=2 ** 30,  # Bytes of exports of read-only databases.
+    EXPORT_CACHE_ACCEL_URL=None,  # Internal URL of EXPORT_CACHE_DIR for nginx.
+    COMPRESSION_MIN_SIZE=1024,  # Bytes; smaller responses are not compressed.
+    # Encoding -> level; 'zstd' and 'br' are used only if package installed.
+    COMPRESSION_LEVELS={"zstd": 3, "br": 4, "gzip": 6},
+    IMPORT_SAMPLE_SIZE=10000,  # Records used to infer the column types.
+    IMPORT_BATCH_SIZE=10000,  # Records converted and inserted at a time.
+    IMPORT_PARALLEL_SIZE=2 ** 26,  # Bytes; larger CSV files parsed in parallel.
+    IMPORT_CHUNK_SIZE=2 ** 22,  # Bytes of a CSV file parsed by one process.
+    IMPORT_WORKERS=4,  # Number of processes parsing a large CSV file.
+    UPLOAD_CHUNK_SIZE=2 ** 20,  # Bytes of an uploaded file written at a time.
     CSV_FILE_DELIMITERS={
         "comma": {"label": "comma ','", "char": ","},
         "tab": {"label": "tab '\\t'", "char": "\t"},
@@ -96,9 +137,52 @@ def init(app):
         raise ValueError("SALT_LENGTH is too short.")
     if app.config["MIN_PASSWORD_LENGTH"] <= 4:
         raise ValueError("MIN_PASSWORD_LENGTH is too short.")
+    for key in ["DBS_PAGE_SIZE", "ROWS_PAGE_SIZE", "ROWS_DISPLAY_PAGE_SIZE"]:
+        if app.config[key] < 1:
+            raise ValueError(f"{key} must be at least 1.")
+    if app.config["PUBLIC_CACHE_MAX_AGE"] < 0:
+        raise ValueError("PUBLIC_CACHE_MAX_AGE must not be negative.")
+    if app.config["USER_CACHE_TTL"] < 0:
+        raise ValueError("USER_CACHE_TTL must not be negative.")
+    if app.config["CNX_POOL_MAX_SIZE"] < 0:
+        raise ValueError("CNX_POOL_MAX_SIZE must not be negative.")
+    if app.config["CNX_POOL_MAX_IDLE"] <= 0:
+        raise ValueError("CNX_POOL_MAX_IDLE must be positive.")
+    if app.config["METADATA_CACHE_SIZE"] < 0:
+        raise ValueError("METADATA_CACHE_SIZE must not be negative.")
+    if app.config["IMMUTABLE_MMAP_SIZE"] < 0:
+        raise ValueError("IMMUTABLE_MMAP_SIZE must not be negative.")
+    if app.config["PRAGMA_PROFILE"] not in app.config["PRAGMA_PROFILES"]:
+        raise ValueError("PRAGMA_PROFILE must be one of PRAGMA_PROFILES.")
     if app.config["EXECUTE_TIMEOUT"] <= 0:
         raise ValueError("EXECUTE_TIMEOUT must be positive.")
-    if app.config["EXECUTE_TIMEOUT_INCREMENT"] <= 0:
-        raise ValueError("EXECUTE_TIMEOUT_INCREMENT must be positive.")
-    if app.config["EXECUTE_TIMEOUT_BACKOFF"] <= 1.0:
-        raise ValueError("EXECUTE_TIMEOUT_BACKOFF must be greater than 1.")
+    for key in ["EXECUTE_TIMEOUT_ROLES", "EXECUTE_TIMEOUT_USERS"]:
+        for timeout in app.config[key].values():
+            if timeout <= 0:
+                raise ValueError(f"{key} values must be positive.")
+    if app.config["EXECUTE_TIMEOUT_INSTRUCTIONS"] < 1:
+        raise ValueError("EXECUTE_TIMEOUT_INSTRUCTIONS must be at least 1.")
+    if app.config["STREAM_TIMEOUT"] <= 0:
+        raise ValueError("STREAM_TIMEOUT must be positive.")
+    for key in [
+        "STREAM_CHUNK_SIZE",
+        "STREAM_BATCH_SIZE",
+        "COLUMNAR_BATCH_SIZE",
+        "EXPORT_WORKERS",
+        "IMPORT_SAMPLE_SIZE",
+        "IMPORT_BATCH_SIZE",
+        "IMPORT_CHUNK_SIZE",
+        "IMPORT_WORKERS",
+        "UPLOAD_CHUNK_SIZE",
+    ]:
+        if app.config[key] < 1:
+            raise ValueError(f"{key} must be at least 1.")
+    if app.config["EXPORT_SPOOL_SIZE"] < 0:
+        raise ValueError("EXPORT_SPOOL_SIZE must not be negative.")
+    if app.config["EXPORT_CACHE_MAX_SIZE"] < 0:
+        raise ValueError("EXPORT_CACHE_MAX_SIZE must not be negative.")
+    if app.config["COMPRESSION_MIN_SIZE"] < 0:
+        raise ValueError("COMPRESSION_MIN_SIZE must not be negative.")
+    for encoding in app.config["COMPRESSION_LEVELS"]:
+        if encoding not in ("zstd", "br", "gzip"):
+            raise ValueError(f"COMPRESSION_LEVELS encoding '{encoding}' unknown.")
@@ -1,8 +1,13 @@
-"Redirect to table or view."
+"Redirect to table or view. Server-side processing for the DataTables grid."
+
+import http.client
+import sqlite3
 
 import flask
 
 import dbshare.db
+from dbshare import constants
+from dbshare import utils
 
 
 blueprint = flask.Blueprint("data", __name__)
@@ -30,3 +35,155 @@ def rows(dbname, dataname):
     return flask.redirect(
         flask.url_for("table.rows", dbname=dbname, tablename=dataname)
     )
+
+
+@blueprint.route("/<name:dbname>/<name:dataname>/datatables")
+def datatables(dbname, dataname):
+    """Return JSON for the DataTables grid, according to its server-side
+    processing protocol. Sorting, filtering and paging are done in SQL.
+    The rows of a table have the rowid appended as the last item.
+    """
+    try:
+        db = dbshare.db.get_check_read(dbname)
+    except ValueError:
+        flask.abort(http.client.UNAUTHORIZED)
+    except KeyError:
+        flask.abort(http.client.NOT_FOUND)
+    try:
+        schema = dbshare.db.get_schema(db, dataname)
+    except ValueError:
+        flask.abort(http.client.NOT_FOUND)
+    if schema["type"] == constants.VIEW:
+        dbshare.db.set_nrows(db, [dataname])
+    try:
+        draw = int(flask.request.args.get("draw") or 0)
+    except ValueError:
+        flask.abort(http.client.BAD_REQUEST)
+    result = {"draw": draw}
+    try:
+        args = get_datatables_args(schema)
+        cnx = dbshare.db.get_cnx(dbname)
+        where, values = get_sql_datatables_filter(schema, args)
+        result["recordsTotal"] = schema.get("nrows")
+        if result["recordsTotal"] is None:
+            sql = f'SELECT COUNT(*) FROM "{dataname}"'
+            result["recordsTotal"] = utils.execute_timeout(cnx, sql).fetchone()[0]
+        if where:
+            # With a condition on an indexed column only, this uses the
+            # index to count the rows, without scanning the table itself.
+            sql = f'SELECT COUNT(*) FROM "{dataname}" WHERE {where}'
+            cursor = utils.execute_timeout(
+                cnx, lambda cnx: cnx.execute(sql, values)
+            )
+            result["recordsFiltered"] = cursor.fetchone()[0]
+        else:
+            result["recordsFiltered"] = result["recordsTotal"]
+        columns = ['"%s"' % c["name"] for c in schema["columns"]]
+        rowid = schema["type"] == constants.TABLE
+        rowid = rowid and dbshare.db.get_row_keys(db, schema) is None
+        if rowid:
+            columns.append("rowid")
+        sql = f'SELECT {",".join(columns)} FROM "{dataname}"'
+        if where:
+            sql += f" WHERE {where}"
+        orderby = []
+        for column, direction in args["order"]:
+            orderby.append(f'"{column}" {direction}')
+        # Make the order of rows with equal sort values well-defined.
+        if orderby and rowid:
+            orderby.append(f"rowid {args['order'][-1][1]}")
+        if orderby:
+            sql += " ORDER BY " + ",".join(orderby)
+        sql += " LIMIT ? OFFSET ?"
+        values = values + [args["length"], args["start"]]
+        cursor = utils.execute_timeout(cnx, lambda cnx: cnx.execute(sql, values))
+        # JSON cannot hold bytes; show them as the HTML page does.
+        result["data"] = [
+            [str(v) if isinstance(v, bytes) else v for v in row] for row in cursor
+        ]
+    except ValueError as error:
+        result["error"] = str(error)
+    except (SystemError, sqlite3.Error) as error:
+        result["error"] = str(error)
+    return flask.jsonify(result)
+
+
+def get_datatables_args(schema):
+    """Return the DataTables request arguments as a dict with items
+    'start', 'length', 'search', 'order' and 'columns_search'.
+    The length is at most MAX_NROWS_DISPLAY.
+    Raise ValueError if any invalid argument.
+    """
+    args = flask.request.args
+    max_length = flask.current_app.config["MAX_NROWS_DISPLAY"]
+    try:
+        start = int(args.get("start") or 0)
+        length = int(args.get("length") or max_length)
+    except ValueError:
+        raise ValueError("invalid start or length")
+    if start < 0:
+        raise ValueError("invalid start")
+    if length < 0:  # DataTables uses -1 for 'all'.
+        length = max_length
+    result = {
+        "start": start,
+        "length": min(length, max_length),
+        "search": args.get("search[value]") or "",
+        "order": [],
+        "columns_search": [],
+    }
+    ncolumns = len(schema["columns"])
+    i = 0
+    while f"order[{i}][column]" in args:
+        try:
+            column = int(args[f"order[{i}][column]"])
+        except ValueError:
+            raise ValueError("invalid order column")
+        # Ignore the columns with buttons that are not in the data.
+        if 0 <= column < ncolumns:
+            direction = args.get(f"order[{i}][dir]", "asc").upper()
+            if direction not in ("ASC", "DESC"):
+                raise ValueError("invalid order direction")
+            result["order"].append((schema["columns"][column]["name"], direction))
+        i += 1
+    for i, column in enumerate(schema["columns"]):
+        value = args.get(f"columns[{i}][search][value]")
+        if value:
+            result["columns_search"].append((column, value))
+    return result
+
+
+def get_sql_datatables_filter(schema, args):
+    """Return the SQL WHERE clause and its values for the search arguments.
+    The global search value matches any part of the value in any column.
+    A column search value matches the value exactly for a numerical column,
+    else as a case-sensitive prefix. This allows using an index on the
+    column, when there is one, and gives the same rows when there is not.
+    """
+    conditions = []
+    values = []
+    for column, value in args["columns_search"]:
+        if column["type"] in (constants.INTEGER, constants.REAL):
+            try:
+                values.append(float(value))
+            except ValueError:
+                raise ValueError(f"invalid number for column {column['name']}")
+            conditions.append(f'"{column["name"]}"=?')
+        else:
+            conditions.append(f'"{column["name"]}">=? AND "{column["name"]}"<?')
+            values.append(value)
+            values.append(value + "\U0010ffff")
+    if args["search"]:
+        pattern = _get_like_pattern(args["search"])
+        search = []
+        for column in schema["columns"]:
+            search.append(f'"{column["name"]}" LIKE ? ESCAPE \'\\\'')
+            values.append(pattern)
+        conditions.append("(" + " OR ".join(search) + ")")
+    return " AND ".join(conditions), values
+
+
+def _get_like_pattern(value):
+    "Return the LIKE pattern matching any part of a value, with escapes."
+    value = value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return f"%{value}%"
@@ -1,11 +1,17 @@
 "Database HTML endpoints."
 
+import collections
+import concurrent.futures
 import copy
 import csv
+import datetime
+import functools
 import hashlib
+import http.client
 import io
 import itertools
 import json
+import multiprocessing
 import os
 import os.path
 import re
@@ -15,10 +21,15 @@ import stat
 import tarfile
 import tempfile
 import urllib.parse
+import zipfile
 
 import flask
 import openpyxl
+import werkzeug.http
 
+import dbshare.exports
+import dbshare.metadata
+import dbshare.pool
 import dbshare.system
 import dbshare.table
 import dbshare.query
@@ -53,6 +64,13 @@ VIEWS_TABLE = {
 }
 
 
+# Files kept by Sqlite3 next to the database file, depending on journal mode.
+SIDECAR_SUFFIXES = ("-wal", "-shm", "-journal")
+
+# File next to the database file with the content hashes computed on upload.
+HASHES_SUFFIX = "-hashes"
+
+
 blueprint = flask.Blueprint("db", __name__)
 
 
@@ -66,32 +84,18 @@ def display(dbname):
         return flask.redirect(flask.url_for("home"))
 
     if dbname.ext in ("tar", "tar.gz", "tar.bz2"):
-        try:
-            mode = "w:" + dbname.ext.split(".")[1]
-        except IndexError:
-            mode = "w"
-        outfile = io.BytesIO()
-        tar = tarfile.open(fileobj=outfile, mode=mode)
-        schemas = list(db["tables"].values()) + list(db["views"].values())
-        for schema in schemas:
-            columns = [c["name"] for c in schema["columns"]]
-            sql = 'SELECT %s FROM "%s"' % (
-                ",".join([f'"{c}"' for c in columns]),
-                schema["name"],
+        key = dbshare.exports.get_key(db, dbname.ext)
+        infile = dbshare.exports.get(key)
+        if infile is not None:
+            return dbshare.exports.send(
+                key,
+                infile,
+                constants.TAR_MIMETYPE,
+                filename=f"{dbname}.{dbname.ext}",
             )
-            writer = utils.CsvWriter(header=columns)
-            try:
-                cursor = utils.execute_timeout(get_cnx(db["name"]), sql)
-            except SystemError:
-                pass
-            else:
-                writer.write_rows(cursor)
-                data = writer.getvalue().encode("utf-8")
-                tarinfo = tarfile.TarInfo(name=f"{dbname}/{schema['name']}.csv")
-                tarinfo.size = len(data)
-                tar.addfile(tarinfo, io.BytesIO(data))
-        tar.close()
-        response = flask.make_response(outfile.getvalue())
+        compression = dbname.ext.partition(".")[2] or None
+        chunks = dbshare.exports.store(key, stream_tar(db, compression=compression))
+        response = flask.Response(flask.stream_with_context(chunks))
         response.headers.set("Content-Type", constants.TAR_MIMETYPE)
         response.headers.set(
             "Content-Disposition", "attachment", filename=f"{dbname}.{dbname.ext}"
@@ -99,38 +103,30 @@ def display(dbname):
         return response
 
     elif dbname.ext == "xlsx":
-        wb = openpyxl.Workbook()
-        ws = wb.active
-        tables = list(db["tables"].values())
-        if tables:
-            ws.title = tables[0]["name"]
-            for table in tables[1:]:
-                ws = wb.create_sheet(title=table["name"])
-        for table in tables:
-            ws = wb[table["name"]]
-            columns = [c["name"] for c in table["columns"]]
-            ws.append(columns)
-            sql = 'SELECT %s FROM "%s"' % (
-                ",".join([f'"{c}"' for c in columns]),
-                table["name"],
+        key = dbshare.exports.get_key(db, "xlsx")
+        infile = dbshare.exports.get(key)
+        if infile is not None:
+            return dbshare.exports.send(
+                key,
+                infile,
+                constants.XLSX_MIMETYPE,
+                filename=f"{dbname}.{dbname.ext}",
             )
-            try:
-                cursor = utils.execute_timeout(get_cnx(db["name"]), sql)
-            except SystemError:
-                pass
-            else:
-                for row in cursor:
-                    ws.append(list(row))
-        with tempfile.NamedTemporaryFile(suffix=".xlsx") as tmp:
-            wb.save(tmp.name)
-            tmp.seek(0)
-            content = tmp.read()
-        response = flask.make_response(content)
-        response.headers.set("Content-Type", constants.XLSX_MIMETYPE)
-        response.headers.set(
-            "Content-Disposition", "attachment", filename=f"{dbname}.{dbname.ext}"
+        # The file object is closed when the response has been sent.
+        # If not cached, the file is thereby deleted.
+        try:
+            infile = dbshare.exports.create(
+                key, lambda outfile: write_xlsx(db, outfile)
+            )
+        except (SystemError, sqlite3.Error) as error:
+            utils.flash_error(error)
+            return flask.redirect(flask.url_for(".display", dbname=str(dbname)))
+        return flask.send_file(
+            infile,
+            mimetype=constants.XLSX_MIMETYPE,
+            as_attachment=True,
+            download_name=f"{dbname}.{dbname.ext}",
         )
-        return response
 
     elif dbname.ext in (None, "html"):
         return flask.render_template(
@@ -250,7 +246,6 @@ def upload(dbname):
     elif utils.http_POST():
         try:
             csvfile = flask.request.files["csvfile"]
-            infile = io.StringIO(csvfile.read().decode("utf-8"))
             delimiter = flask.request.form.get("delimiter") or "comma"
             try:
                 delimiter = flask.current_app.config["CSV_FILE_DELIMITERS"][delimiter][
@@ -268,21 +263,28 @@ def upload(dbname):
             tablename = utils.name_cleaned(tablename)
             if utils.name_in_nocase(tablename, db["tables"]):
                 raise ValueError("table name already in use")
-            # Read the file; eliminate empty records.
-            records = [r for r in csv.reader(infile, delimiter=delimiter) if r]
-            if not records:
-                raise ValueError("empty CSV file")
-            # Change empty string items to None.
-            for record in records:
-                for i, item in enumerate(record):
-                    if item == "":
-                        record[i] = None
             has_header = utils.to_bool(flask.request.form.get("header"))
+            size = flask.request.content_length or 0
             with DbSaver(db) as saver:
-                saver.create_table_load_records(
-                    tablename, records, has_header=has_header
-                )
-            utils.flash_message(f"Loaded {len(records)} records.")
+                if size < flask.current_app.config["IMPORT_PARALLEL_SIZE"]:
+                    # The file is read and loaded in batches, not all at once.
+                    infile = io.TextIOWrapper(
+                        csvfile.stream, encoding="utf-8", newline=""
+                    )
+                    count = saver.create_table_load_records(
+                        tablename,
+                        functools.partial(read_csv_records, infile, delimiter),
+                        has_header=has_header,
+                    )
+                else:
+                    # A named file is needed for parsing it in parallel.
+                    with tempfile.NamedTemporaryFile(suffix=".csv") as outfile:
+                        csvfile.save(outfile)
+                        outfile.flush()
+                        count = saver.create_table_load_csv(
+                            tablename, outfile.name, delimiter, has_header=has_header
+                        )
+            utils.flash_message(f"Loaded {count} records.")
         except (ValueError, IndexError, sqlite3.Error) as error:
             utils.flash_error(error)
             return flask.redirect(
@@ -317,7 +319,10 @@ def clone(dbname):
         except (KeyError, ValueError) as error:
             utils.flash_error(error)
             return flask.redirect(flask.url_for(".clone", dbname=dbname))
-        shutil.copyfile(utils.get_dbpath(dbname), utils.get_dbpath(saver.db["name"]))
+        # The backup API gives a consistent copy, also in WAL journal mode.
+        target = sqlite3.connect(utils.get_dbpath(saver.db["name"]))
+        get_cnx(dbname).backup(target)
+        target.close()
         db = get_db(name, complete=True)
         with DbSaver(db) as saver:
             saver.db["cloned"] = dbname  # Will show up in logs
@@ -332,6 +337,8 @@ def download(dbname):
     except (KeyError, ValueError) as error:
         utils.flash_error(error)
         return flask.redirect(flask.url_for("home"))
+    if not db["readonly"]:
+        checkpoint(dbname)  # Any write-ahead log contents into the file.
     return flask.send_file(
         utils.get_dbpath(dbname),
         mimetype=constants.SQLITE3_MIMETYPE,
@@ -355,6 +362,7 @@ def vacuum(dbname):
             for schema in db["tables"].values():
                 saver.update_table(schema)
         get_cnx(db["name"], write=True).execute("VACUUM")
+        update_size(db["name"])
     except sqlite3.Error as error:
         utils.flash_error(error)
     return flask.redirect(flask.url_for(".display", dbname=db["name"]))
@@ -493,6 +501,7 @@ class DbSaver:
                 "owner": flask.g.current_user["username"],
                 "public": False,
                 "readonly": False,
+                "profile": None,
                 "hashes": {},
                 "created": utils.get_time(),
             }
@@ -516,19 +525,26 @@ class DbSaver:
 
     def __exit__(self, etyp, einst, etb):
         if etyp is not None:
+            # Changes may have been committed to the database before the error.
+            if self.db.get("name"):
+                dbshare.metadata.invalidate(self.db["name"])
             return False
         for key in ["name", "owner"]:
             if not self.db.get(key):
                 raise ValueError(f"invalid db: {key} not set")
         self.db["modified"] = utils.get_time()
+        if not self.old and not os.path.exists(utils.get_dbpath(self.db["name"])):
+            # This actually creates the database file, unless uploaded.
+            self.dbcnx
+        self.db["size"] = get_file_size(self.db["name"])
         cnx = utils.get_cnx(write=True)
         with cnx:
             # Update the existing database entry in system.
             if self.old:
                 sql = (
                     "UPDATE dbs SET name=?, owner=?, title=?,"
-                    "description=?, public=?, readonly=?, modified=?"
-                    " WHERE name=?"
+                    "description=?, public=?, readonly=?, profile=?, size=?,"
+                    " modified=? WHERE name=?"
                 )
                 cnx.execute(
                     sql,
@@ -539,6 +555,8 @@ class DbSaver:
                         self.db.get("description"),
                         bool(self.db["public"]),
                         bool(self.db["readonly"]),
+                        self.db.get("profile"),
+                        self.db["size"],
                         self.db["modified"],
                         self.old["name"],
                     ),
@@ -568,13 +586,12 @@ class DbSaver:
 
             # New database.
             else:
-                # This actually creates the database file.
-                self.dbcnx
                 # Create the database entry in system.
                 sql = (
                     "INSERT INTO dbs"
                     " (name, owner, title, description, public, readonly,"
-                    "  created, modified) VALUES (?, ?, ?, ?, ?, ?, ?, ?)"
+                    "  profile, size, created, modified)"
+                    " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"
                 )
                 cnx.execute(
                     sql,
@@ -585,6 +602,8 @@ class DbSaver:
                         self.db.get("description"),
                         bool(self.db["public"]),
                         bool(self.db["readonly"]),
+                        self.db.get("profile"),
+                        self.db["size"],
                         self.db["created"],
                         self.db["modified"],
                     ),
@@ -594,7 +613,8 @@ class DbSaver:
             for key, value in self.db.items():
                 if value != self.old.get(key):
                     new[key] = value
-            new.pop("modified")
+            new.pop("modified", None)
+            new.pop("size", None)
             try:
                 editor = flask.g.current_user["username"]
             except AttributeError:
@@ -621,6 +641,15 @@ class DbSaver:
                     utils.get_time(),
                 ),
             )
+        dbshare.metadata.invalidate(self.db["name"])
+        if self.old and self.old["name"] != self.db["name"]:
+            dbshare.metadata.invalidate(self.old["name"])
+        # Pooled connections were opened with the previous mode or profile.
+        if self.old and (
+            self.old["readonly"] != self.db["readonly"]
+            or self.old.get("profile") != self.db.get("profile")
+        ):
+            dbshare.pool.invalidate(self.db["name"])
         # Set the OS-level file permissions.
         if self.db["readonly"]:
             os.chmod(utils.get_dbpath(self.db["name"]), stat.S_IREAD)
@@ -650,7 +679,15 @@ class DbSaver:
         old_dbname = self.db.get("name")
         if old_dbname:
             # Rename the Sqlite3 file if the database already exists.
-            os.rename(utils.get_dbpath(old_dbname), utils.get_dbpath(name))
+            # Move the contents of any write-ahead log into it first.
+            checkpoint(old_dbname)
+            old_dbpath = utils.get_dbpath(old_dbname)
+            dbpath = utils.get_dbpath(name)
+            os.rename(old_dbpath, dbpath)
+            for suffix in SIDECAR_SUFFIXES + (HASHES_SUFFIX,):
+                if os.path.exists(old_dbpath + suffix):
+                    os.rename(old_dbpath + suffix, dbpath + suffix)
+            dbshare.pool.invalidate(old_dbname)
             # The entries in the dbs_log will be fixed in '__exit__'
         self.db["name"] = name
         return self.db["name"]
@@ -674,26 +711,45 @@ class DbSaver:
     def set_readonly(self, mode):
         """Set to 'readonly' (True) or 'readwrite' (False).
         If 'readonly', then compute the hash values, else remove them.
+        The hash values computed on upload are used if the file is unchanged.
         """
         if self.db["readonly"] == mode:
             return
+        if mode:
+            hashes = pop_upload_hashes(self.db["name"])
+            # The file must contain all data; nothing left in write-ahead log.
+            if hashes is None and not checkpoint(
+                self.db["name"], journal_mode="DELETE"
+            ):
+                raise ValueError("database is busy; cannot set read-only")
         self.db["readonly"] = self.readonly = mode
         if mode:
-            hashes = {}
-            for hashname in flask.current_app.config["CONTENT_HASHES"]:
-                hashes[hashname] = hashlib.new(hashname)
-            with open(utils.get_dbpath(self.db["name"]), "rb") as infile:
-                data = infile.read(8192)
-                while data:
-                    for hash in hashes.values():
-                        hash.update(data)
+            if hashes is None:
+                hashes = {}
+                for hashname in flask.current_app.config["CONTENT_HASHES"]:
+                    hashes[hashname] = hashlib.new(hashname)
+                with open(utils.get_dbpath(self.db["name"]), "rb") as infile:
                     data = infile.read(8192)
-            for hashname in hashes:
-                hashes[hashname] = hashes[hashname].hexdigest()
+                    while data:
+                        for hash in hashes.values():
+                            hash.update(data)
+                        data = infile.read(8192)
+                for hashname in hashes:
+                    hashes[hashname] = hashes[hashname].hexdigest()
             self.db["hashes"] = hashes
         else:
+            # The exports cached for the content are no longer needed.
+            dbshare.exports.purge(self.db)
             self.db["hashes"] = {}
 
+    def set_profile(self, profile):
+        """Set the PRAGMA profile to use for the database.
+        If None, then the default profile is used.
+        """
+        if profile and profile not in flask.current_app.config["PRAGMA_PROFILES"]:
+            raise ValueError("no such PRAGMA profile")
+        self.db["profile"] = profile or None
+
     def initialize(self):
         "Create the DbShare metadata tables and indexes if they do not exist."
         # Implicitly creates the file, or checks that it is an Sqlite3 file.
@@ -704,103 +760,170 @@ class DbSaver:
         sql = get_sql_create_table(VIEWS_TABLE, if_not_exists=True)
         self.dbcnx.execute(sql)
 
-    def create_table_load_records(self, tablename, records, has_header=True):
+    def create_table_load_csv(self, tablename, filepath, delimiter, has_header=True):
+        """Create and load table from the CSV file at the given path.
+        A file of at least IMPORT_PARALLEL_SIZE bytes is split into chunks
+        of IMPORT_CHUNK_SIZE bytes, which are parsed and converted in
+        IMPORT_WORKERS processes, while inserted in order by this one.
+        The number of processes is limited by the number of CPUs; with only
+        one, the file is parsed in this process.
+        Return the number of records loaded.
+        Raises ValueError or sqlite3.Error if any problem.
+        """
+        config = flask.current_app.config
+        if (
+            os.path.getsize(filepath) < config["IMPORT_PARALLEL_SIZE"]
+            or get_import_workers() < 2
+        ):
+            with open(filepath, encoding="utf-8", newline="") as infile:
+                return self.create_table_load_records(
+                    tablename,
+                    functools.partial(read_csv_records, infile, delimiter),
+                    has_header,
+                )
+        # The header and the sample for inferring the types are parsed here,
+        # from the first chunks; the rest of the file in the other processes.
+        count = 0
+        sample_end = 0
+        for begin, sample_end in get_csv_chunks(filepath, config["IMPORT_CHUNK_SIZE"]):
+            count += len(read_csv_chunk(filepath, begin, sample_end, delimiter))
+            if count > config["IMPORT_SAMPLE_SIZE"]:
+                break
+        return self.create_table_load_records(
+            tablename,
+            functools.partial(read_csv_chunk, filepath, 0, sample_end, delimiter),
+            has_header,
+            batches=functools.partial(
+                convert_csv_chunks, filepath, sample_end, delimiter
+            ),
+        )
+
+    def create_table_load_records(
+        self, tablename, records, has_header=True, batches=None
+    ):
         """Create and load table from records (lists of data items).
-        Infer table column types and constraints from records contents.
+        'records' is a callable returning the records from the first one,
+        as any iterable; it is read only once.
+        Infer table column types and constraints from the contents of the
+        first IMPORT_SAMPLE_SIZE records. Then convert and insert the
+        records in batches of IMPORT_BATCH_SIZE, within one transaction.
+        A column is widened if a later record does not fit its type or
+        constraint; e.g. INTEGER becomes REAL, or NOT NULL is dropped.
+        If 'batches' is given, it is called after the records have been
+        loaded, with the columns and the number of the next record, to
+        obtain further batches of records already converted, each with
+        the columns as widened to fit it.
+        A column widened to TEXT would have the values already inserted
+        in their converted form, e.g. '007' as 7. In that case the table
+        is emptied, and all records are loaded again with the new types.
+        Return the number of records loaded.
         Raises ValueError or sqlite3.Error if any problem.
         """
+        config = flask.current_app.config
+        rows = iter(records())
         # Column names from header, or make up.
         if has_header:
-            header = records.pop(0)
+            try:
+                header = next(rows)
+            except StopIteration:
+                raise ValueError("no records to load")
             header = [utils.name_cleaned(n) for n in header]
             if len(header) != len(set(header)):
                 raise ValueError("non-unique header column names")
-        else:
-            header = [f"column{i+1}" for i in range(len(records[0]))]
+        sample = list(itertools.islice(rows, config["IMPORT_SAMPLE_SIZE"]))
+        if not has_header:
+            if not sample:
+                raise ValueError("no records to load")
+            header = [f"column{i+1}" for i in range(len(sample[0]))]
 
         # Infer column types and constraints.
         schema = {"name": tablename}
         schema["columns"] = [{"name": name} for name in header]
-        try:
-            for i, column in enumerate(schema["columns"]):
-                type = None
-                column["notnull"] = True
-
-                # First attempt: integer
-                for n, record in enumerate(records):
-                    value = record[i]
-                    if value is None:
-                        column["notnull"] = False
-                    elif isinstance(value, int):
-                        pass
-                    elif isinstance(value, str):
-                        try:
-                            int(value)
-                        except (ValueError, TypeError):
-                            break
-                    else:
-                        break
-                else:
-                    type = constants.INTEGER
-
-                # Next attempt: float
-                if type is None:
-                    for n, record in enumerate(records):
-                        value = record[i]
-                        if value is None:
-                            column["notnull"] = False
-                        elif isinstance(value, (float, int)):
-                            pass
-                        elif isinstance(value, str):
-                            try:
-                                float(value)
-                            except (ValueError, TypeError):
-                                break
-                        else:
-                            break
-                    else:
-                        type = constants.REAL
-
-                # Default: text
-                if type is None:
-                    column["type"] = constants.TEXT
-                    if column["notnull"]:
-                        for record in records:
-                            value = record[i]
-                            if value is None:
-                                column["notnull"] = False
-                                break
-                else:
-                    column["type"] = type
-        except IndexError:
-            raise ValueError(f"record {i+1} has too few items")
+        sample = infer_column_types(schema["columns"], sample)
 
         # Create the table.
         self.add_table(schema)
 
-        # Actually convert values in records.
-        for i, column in enumerate(schema["columns"]):
-            type = column["type"]
-            if type == constants.INTEGER:
-                for n, record in enumerate(records):
-                    value = record[i]
-                    if value is not None:
-                        record[i] = int(value)
-            elif type == constants.REAL:
-                for n, record in enumerate(records):
-                    value = record[i]
-                    if value is not None:
-                        record[i] = float(value)
-
-        # Insert the data.
+        try:
+            with self.dbcnx:
+                while True:
+                    count = self.insert_records(schema, sample, rows, batches)
+                    if count is not None:
+                        break
+                    # A column was widened to TEXT; start over.
+                    self.dbcnx.execute(f'DELETE FROM "{tablename}"')
+                    self.rebuild_table(schema)
+                    rows = iter(records())
+                    if has_header:
+                        next(rows)
+                    sample = list(itertools.islice(rows, config["IMPORT_SAMPLE_SIZE"]))
+                    sample = convert_records(schema["columns"], sample)[0]
+        except (ValueError, sqlite3.Error):
+            self.delete_table(tablename)
+            raise
+        self.update_table(schema)
+        return count
+
+    def insert_records(self, schema, sample, records, batches=None):
+        """Insert the sample records, which have already been converted.
+        Then convert and insert the further records, and any further batches,
+        as described for 'create_table_load_records'.
+        Return the number of records inserted, or None if a column had to be
+        widened to TEXT, in which case the remaining records are not inserted.
+        The caller is responsible for the transaction.
+        """
+        columns = schema["columns"]
         sql = 'INSERT INTO "%s" (%s) VALUES (%s)' % (
-            tablename,
-            ",".join(['"%(name)s"' % c for c in schema["columns"]]),
-            ",".join("?" * len(schema["columns"])),
+            schema["name"],
+            ",".join(['"%(name)s"' % c for c in columns]),
+            ",".join("?" * len(columns)),
         )
-        with self.dbcnx:
-            self.dbcnx.executemany(sql, records)
-        self.update_table(schema)
+        batch_size = flask.current_app.config["IMPORT_BATCH_SIZE"]
+        self.dbcnx.executemany(sql, sample)
+        count = len(sample)
+        while True:
+            batch = list(itertools.islice(records, batch_size))
+            if not batch:
+                break
+            types = [c["type"] for c in columns]
+            batch, widened = convert_records(columns, batch, start=count + 1)
+            if widened:
+                if is_widened_to_text(types, columns):
+                    return None
+                self.rebuild_table(schema)
+            self.dbcnx.executemany(sql, batch)
+            count += len(batch)
+        if batches is not None:
+            chunks = batches(columns, count + 1)
+            try:
+                for batch, others in chunks:
+                    types = [c["type"] for c in columns]
+                    if widen_columns(columns, others):
+                        if is_widened_to_text(types, columns):
+                            return None
+                        self.rebuild_table(schema)
+                    self.dbcnx.executemany(sql, batch)
+                    count += len(batch)
+            finally:
+                # Discard any work in progress if returning early.
+                chunks.close()
+        return count
+
+    def rebuild_table(self, schema):
+        """Recreate the table according to its modified schema, keeping
+        the rows, whose values are converted according to the column types.
+        Only for a table without indexes, and not used by any view.
+        The caller is responsible for the transaction.
+        """
+        name = schema["name"]
+        tmpname = f"_{name}_rebuild"
+        self.dbcnx.execute(get_sql_create_table(dict(schema, name=tmpname)))
+        colnames = ",".join([f'"{c["name"]}"' for c in schema["columns"]])
+        self.dbcnx.execute(
+            f'INSERT INTO "{tmpname}" ({colnames}) SELECT {colnames} FROM "{name}"'
+        )
+        self.dbcnx.execute(f'DROP TABLE "{name}"')
+        self.dbcnx.execute(f'ALTER TABLE "{tmpname}" RENAME TO "{name}"')
 
     def add_table(self, schema, query=None, create=True):
         """Create the table in the database and add to the database definition.
@@ -1025,13 +1148,15 @@ class DbSaver:
         Return False if no metadata (i.e. not a DbShare file), else True.
         Raises ValueError or sqlite3.Error if any problem.
         """
+        # Only reading; the file is not modified.
+        cnx = get_cnx(self.db["name"])
         sql = f"SELECT COUNT(*) FROM {constants.TABLES}"
-        if self.dbcnx.execute(sql).fetchone()[0] == 0:
+        if cnx.execute(sql).fetchone()[0] == 0:
             return False  # No metadata; skip.
         sql = f"SELECT name FROM {constants.TABLES}"
-        tables1 = [r[0] for r in self.dbcnx.execute(sql)]
+        tables1 = [r[0] for r in cnx.execute(sql)]
         sql = "SELECT name FROM sqlite_master WHERE type=?"
-        tables2 = [r[0] for r in self.dbcnx.execute(sql, ("table",))]
+        tables2 = [r[0] for r in cnx.execute(sql, ("table",))]
         # Do not consider metadata tables and sqlite statistics tables, if any.
         tables2 = [n for n in tables2 if not n.startswith("_")]
         tables2 = [n for n in tables2 if not n.startswith("sqlite_")]
@@ -1039,10 +1164,10 @@ class DbSaver:
             raise ValueError("corrupt metadata in DbShare Sqlite3 file")
         # Does the index metatable exist?
         sql = f"SELECT name, schema FROM {constants.INDEXES}"
-        self.dbcnx.execute(sql)
+        cnx.execute(sql)
         # Does the views metatable exist?
         sql = f"SELECT name, schema FROM {constants.VIEWS}"
-        self.dbcnx.execute(sql)
+        cnx.execute(sql)
         return True
 
     def infer_metadata(self):
@@ -1123,11 +1248,36 @@ class DbSaver:
 def get_db(name, complete=False):
     """Return the database metadata for the given name.
     Return None if no such database.
+    The metadata is cached, and validated against the state of the files.
     """
+    try:
+        version = (
+            dbshare.metadata.get_file_state(utils.get_dbpath(constants.SYSTEM)),
+            dbshare.metadata.get_file_state(utils.get_dbpath(name)),
+        )
+    except OSError:  # No such database file; don't use the cache.
+        return _get_db(name, complete=complete)
+    data_versions = {
+        id(flask.g.syscnx): dbshare.metadata.get_data_version(flask.g.syscnx)
+    }
+    if complete:
+        cnx = get_cnx(name)
+        data_versions[id(cnx)] = dbshare.metadata.get_data_version(cnx)
+    db = dbshare.metadata.get(name, version, data_versions, complete=complete)
+    if db is None:
+        generation = dbshare.metadata.get_generation(name)
+        db = _get_db(name, complete=complete)
+        if db is not None:
+            dbshare.metadata.put(name, version, data_versions, db, generation)
+    return db
+
+
+def _get_db(name, complete=False):
+    "Read the database metadata for the given name. None if no such database."
     cursor = flask.g.syscnx.cursor()
     sql = (
         "SELECT owner, title, description, public, readonly,"
-        " created, modified FROM dbs WHERE name=?"
+        " profile, size, created, modified FROM dbs WHERE name=?"
     )
     cursor.execute(sql, (name,))
     rows = cursor.fetchall()
@@ -1137,7 +1287,8 @@ def get_db(name, complete=False):
     db.update(rows[0])
     db["public"] = bool(db["public"])
     db["readonly"] = bool(db["readonly"])
-    db["size"] = os.path.getsize(utils.get_dbpath(name))
+    if db["size"] is None:
+        db["size"] = get_file_size(name)
     db["hashes"] = {}
     sql = "SELECT hashname, hashvalue FROM dbs_hashes WHERE name=?"
     cursor.execute(sql, (name,))
@@ -1159,15 +1310,37 @@ def get_db(name, complete=False):
 
 def get_usage(username=None):
     "Return the number and total size of the databases for the user, or all."
-    cursor = flask.g.syscnx.cursor()
     if username:
-        sql = "SELECT name FROM dbs WHERE owner=?"
-        cursor.execute(sql, (username,))
+        sql = "SELECT COUNT(*), SUM(size) FROM dbs WHERE owner=?"
+        row = flask.g.syscnx.execute(sql, (username,)).fetchone()
     else:
-        sql = "SELECT name FROM dbs"
-        cursor.execute(sql)
-    rows = cursor.fetchall()
-    return (len(rows), sum([os.path.getsize(utils.get_dbpath(row[0])) for row in rows]))
+        sql = "SELECT COUNT(*), SUM(size) FROM dbs"
+        row = flask.g.syscnx.execute(sql).fetchone()
+    return (row[0], row[1] or 0)
+
+
+def get_file_size(dbname):
+    "Return the size of the database file, including any write-ahead log."
+    dbpath = utils.get_dbpath(dbname)
+    size = os.path.getsize(dbpath)
+    try:
+        size += os.path.getsize(dbpath + "-wal")
+    except OSError:
+        pass
+    return size
+
+
+def update_size(dbname):
+    """Set the size of the database in the system database from its file.
+    Return the size. To be done after operations changing the file size
+    that are not done within a DbSaver context.
+    """
+    size = get_file_size(dbname)
+    cnx = utils.get_cnx(write=True)
+    with cnx:
+        cnx.execute("UPDATE dbs SET size=? WHERE name=?", (size, dbname))
+    dbshare.metadata.invalidate(dbname)
+    return size
 
 
 def check_quota(user=None, size=0):
@@ -1197,6 +1370,251 @@ def get_schema(db, sourcename):
     return schema
 
 
+def get_row_keys(db, schema):
+    """Return the columns to order the rows of the table or view by for
+    keyset pagination, or None if the rowid is to be used.
+    A view, or a table created WITHOUT ROWID, has no rowid. Its rows are
+    ordered by the primary key columns, if any, else by all columns.
+    """
+    if schema["name"] in db["tables"]:
+        try:
+            get_cnx(db["name"]).execute(f'SELECT rowid FROM "{schema["name"]}" LIMIT 0')
+            return None
+        except sqlite3.OperationalError:  # No such column: it is WITHOUT ROWID.
+            pass
+    keys = [c["name"] for c in schema["columns"] if c.get("primarykey")]
+    return keys or [c["name"] for c in schema["columns"]]
+
+
+def get_csv_records(infile, delimiter):
+    """Yield the records of the CSV file opened in text mode.
+    Empty records are skipped, and empty string items are changed to None.
+    """
+    for record in csv.reader(infile, delimiter=delimiter):
+        if record:
+            yield [item if item != "" else None for item in record]
+
+
+def read_csv_records(infile, delimiter):
+    """Return the records of the CSV file opened in text mode, from its start.
+    The file must be seekable.
+    """
+    infile.seek(0)
+    return get_csv_records(infile, delimiter)
+
+
+def infer_column_types(columns, records):
+    """Set the type and the 'notnull' flag of the columns from the values
+    in the records. A column is INTEGER or REAL if all its values are, or
+    can be converted to, that type. Otherwise the column is TEXT.
+    A column without any values is INTEGER.
+    Return the records with the values converted according to the types.
+    Raises ValueError if a record has the wrong number of items.
+    """
+    for column in columns:
+        column["type"] = None
+        column["notnull"] = True
+    records = convert_records(columns, records)[0]
+    for column in columns:
+        column["type"] = column["type"] or constants.INTEGER
+    return records
+
+
+def convert_column(values, coltype=None, notnull=True):
+    """Return the type, the 'notnull' flag and the converted values of
+    the values for a column, starting from the given type and flag.
+    The type is widened along INTEGER, REAL, TEXT as needed to fit all
+    values, which are converted by the built-in function for the type
+    in a single pass. The type remains None if all values are null.
+    """
+    if None in values:
+        notnull = False
+        nonnull = [v for v in values if v is not None]
+    else:
+        nonnull = values
+    if coltype == constants.TEXT or not nonnull:
+        return coltype, notnull, values
+    kinds = set(map(type, nonnull))
+    if not kinds.issubset((str, int, float, bool)):
+        return constants.TEXT, notnull, values
+    if float in kinds:  # Would be truncated by 'int'.
+        coltype = constants.REAL
+    converted = None
+    if coltype != constants.REAL:
+        try:
+            converted = list(map(int, nonnull))
+            coltype = constants.INTEGER
+        except ValueError:
+            pass
+    if converted is None:
+        try:
+            converted = list(map(float, nonnull))
+            coltype = constants.REAL
+        except ValueError:
+            return constants.TEXT, notnull, values
+    if nonnull is not values:
+        converted = iter(converted)
+        converted = [None if v is None else next(converted) for v in values]
+    return coltype, notnull, converted
+
+
+def check_records_length(records, length, start=1):
+    """Raise ValueError if any record does not have the given length.
+    'start' is the number of the first record, for error messages.
+    """
+    if set(map(len, records)).issubset((length,)):
+        return
+    for n, record in enumerate(records):
+        if len(record) < length:
+            raise ValueError(f"record {start+n} has too few items")
+        elif len(record) > length:
+            raise ValueError(f"record {start+n} has too many items")
+
+
+def convert_records(columns, records, start=1):
+    """Return the records with the values converted according to the types
+    of the columns, and whether any column was widened. If a value does not
+    fit the type or the 'notnull' flag of its column, then the column
+    is widened accordingly.
+    'start' is the number of the first record, for error messages.
+    Raises ValueError if a record has the wrong number of items.
+    """
+    check_records_length(records, len(columns), start=start)
+    values = list(zip(*records)) or [()] * len(columns)
+    widened = False
+    for i, column in enumerate(columns):
+        coltype, notnull, values[i] = convert_column(
+            values[i], column["type"], column["notnull"]
+        )
+        if coltype != column["type"] or notnull != column["notnull"]:
+            column["type"] = coltype
+            column["notnull"] = notnull
+            widened = True
+    return list(zip(*values)), widened
+
+
+def is_widened_to_text(types, columns):
+    "Has any column been widened to TEXT from the given previous types?"
+    for coltype, column in zip(types, columns):
+        if column["type"] == constants.TEXT and coltype != constants.TEXT:
+            return True
+    return False
+
+
+def widen_columns(columns, others):
+    """Widen the types and 'notnull' flags of the columns to fit also
+    the corresponding other columns. Return True if any column was widened.
+    """
+    widened = False
+    for column, other in zip(columns, others):
+        order = constants.COLUMN_TYPES.index
+        if order(other["type"]) > order(column["type"]):
+            column["type"] = other["type"]
+            widened = True
+        if column["notnull"] and not other["notnull"]:
+            column["notnull"] = False
+            widened = True
+    return widened
+
+
+def get_csv_chunks(filepath, chunk_size, begin=0):
+    """Yield the (begin, end) byte offsets of consecutive chunks of about
+    'chunk_size' bytes of the CSV file, starting at offset 'begin', which
+    must be at the start of a record. A chunk ends with a newline which is
+    not within a quoted value, i.e. has an even number of quote characters
+    before it in the chunk. A record longer than 'chunk_size' is kept whole.
+    """
+    with open(filepath, "rb") as infile:
+        size = os.fstat(infile.fileno()).st_size
+        while begin < size:
+            infile.seek(begin)
+            data = infile.read(chunk_size)
+            while True:
+                end = _get_records_end(data)
+                if end or len(data) >= size - begin:
+                    break
+                data += infile.read(chunk_size)
+            end = begin + (end or len(data))
+            yield begin, end
+            begin = end
+
+
+def _get_records_end(data):
+    "Return the position after the last newline ending a record, or 0."
+    pos = len(data)
+    while True:
+        pos = data.rfind(b"\n", 0, pos)
+        if pos < 0:
+            return 0
+        if data.count(b'"', 0, pos) % 2 == 0:
+            return pos + 1
+
+
+def read_csv_chunk(filepath, begin, end, delimiter):
+    "Return the records in the given byte range of the CSV file."
+    with open(filepath, "rb") as infile:
+        infile.seek(begin)
+        data = infile.read(end - begin).decode("utf-8")
+    return list(get_csv_records(io.StringIO(data, newline=""), delimiter))
+
+
+def get_import_workers():
+    "Return the number of processes to use for parsing a large CSV file."
+    return min(flask.current_app.config["IMPORT_WORKERS"], os.cpu_count() or 1)
+
+
+def convert_csv_chunks(filepath, begin, delimiter, columns, start=1):
+    """Yield the converted records of the chunks of the CSV file in order,
+    each with the columns as widened to fit them; see 'convert_records'.
+    The chunks of IMPORT_CHUNK_SIZE bytes start at the byte offset 'begin'.
+    They are parsed and converted in separate processes, at most
+    IMPORT_WORKERS at a time, each according to the columns as they are
+    when the chunk is started.
+    'start' is the number of the first record, for error messages.
+    """
+    nworkers = get_import_workers()
+    context = multiprocessing.get_context("spawn")
+    chunks = get_csv_chunks(
+        filepath, flask.current_app.config["IMPORT_CHUNK_SIZE"], begin=begin
+    )
+    futures = collections.deque()
+    with concurrent.futures.ProcessPoolExecutor(nworkers, context) as executor:
+        try:
+            while True:
+                # Keep the workers busy with the chunks coming up.
+                for begin, end in itertools.islice(chunks, 2 * nworkers - len(futures)):
+                    futures.append(
+                        executor.submit(
+                            _convert_csv_chunk, filepath, begin, end, delimiter, columns
+                        )
+                    )
+                if not futures:
+                    break
+                records, chunk_columns = futures.popleft().result()
+                if chunk_columns is None:
+                    check_records_length(records, len(columns), start=start)
+                start += len(records)
+                yield records, chunk_columns
+        finally:
+            # Discard any remaining work, e.g. if an error occurred.
+            for future in futures:
+                future.cancel()
+
+
+def _convert_csv_chunk(filepath, begin, end, delimiter, columns):
+    """Return the converted records in the given byte range of the CSV file,
+    and the columns as widened to fit them. Runs in a separate process.
+    If a record has the wrong number of items, then return the records
+    unconverted and None, for the caller to report the record number.
+    """
+    records = read_csv_chunk(filepath, begin, end, delimiter)
+    try:
+        records, widened = convert_records(columns, records)
+    except ValueError:
+        return records, None
+    return records, columns
+
+
 def get_sql_create_table(schema, if_not_exists=False):
     """Return SQL to create a table given by its schema.
     Raise ValueError if any problem.
@@ -1270,20 +1688,46 @@ def get_sql_create_index(tablename, schema, if_not_exists=False):
 
 def get_cnx(dbname, write=False):
     """Get the connection for the database given by name.
-    IMPORTANT: Only one connection to a non-system database can be open at any time!
-    If the 'write' mode is wrong, then close and re-open.
+    The read and write connections to each database are kept in a registry
+    for the duration of the request, and are returned to the pool when the
+    app context is torn down. The number of connections checked out from
+    the pool is counted; the pool itself counts those actually opened.
     """
+    registry = flask.g.setdefault("dbcnxs", {})
+    key = (dbname, bool(write))
     try:
-        if write == flask.g.dbwrite:
-            return flask.g.dbcnx
-        else:
-            flask.g.dbcnx.close()
-    except AttributeError:
-        pass
-    flask.g.dbcnx = utils.get_cnx(dbname, write=write)
-    flask.g.dbname = dbname
-    flask.g.dbwrite = write
-    return flask.g.dbcnx
+        return registry[key]
+    except KeyError:
+        readonly, profile = get_mode_profile(dbname)
+        registry[key] = utils.get_cnx(
+            dbname, write=write, immutable=not write and readonly, profile=profile
+        )
+        flask.g.dbcnx_checkouts = flask.g.get("dbcnx_checkouts", 0) + 1
+        return registry[key]
+
+
+def get_mode_profile(dbname):
+    """Return the read-only mode and PRAGMA profile name for the database.
+    A database in read-only mode has a file that will not change.
+    """
+    sql = "SELECT readonly, profile FROM dbs WHERE name=?"
+    row = flask.g.syscnx.execute(sql, (dbname,)).fetchone()
+    if row is None:
+        return (False, None)
+    return (bool(row[0]), row[1])
+
+
+def checkpoint(dbname, journal_mode=None):
+    """Move the contents of any write-ahead log into the database file,
+    and truncate the log. Optionally also change the journal mode,
+    if this can be done without waiting for other connections.
+    Return False if the checkpoint could not be completed due to readers.
+    """
+    cnx = get_cnx(dbname, write=True)
+    busy = cnx.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchone()[0]
+    if journal_mode:
+        utils.set_journal_mode(cnx, journal_mode)
+    return not busy
 
 
 def has_read_access(db):
@@ -1338,6 +1782,73 @@ def get_check_write(dbname, check_mode=True, nrows=False, complete=True):
     return db
 
 
+def check_not_modified(db):
+    """Return the response 304 Not Modified if the conditional headers of
+    the request show that the client has the current version of the data
+    or metadata of the database, else None. To be called before querying
+    the database. The validators and the cache directives are recorded
+    to be set in the response by 'set_conditional_headers'.
+    """
+    etag, last_modified = get_validators(db)
+    if db["public"] and db["readonly"] and not flask.g.current_user:
+        max_age = flask.current_app.config["PUBLIC_CACHE_MAX_AGE"]
+        cache_control = f"public, max-age={max_age}"
+    elif db["public"]:
+        cache_control = "no-cache"
+    else:
+        cache_control = "private, no-cache"
+    flask.g.conditional = (etag, last_modified, cache_control)
+    if werkzeug.http.is_resource_modified(
+        flask.request.environ, etag=etag, last_modified=last_modified
+    ):
+        return None
+    return flask.Response(status=http.client.NOT_MODIFIED)
+
+
+def get_validators(db):
+    """Return the strong ETag and the Last-Modified time for the current
+    version of the database. A read-only database is identified by its
+    content hashes. A writable database is identified by the state of its
+    files, which changes with every commit by any connection or process.
+    The metadata modification time, the user and the headers Accept and
+    Accept-Encoding are also included, since these may affect the response.
+    """
+    state = dbshare.metadata.get_file_state(utils.get_dbpath(db["name"]))
+    parts = [db["modified"]]
+    if db["readonly"]:
+        parts.append(sorted(db["hashes"].items()))
+    else:
+        parts.append(state)
+    user = flask.g.current_user
+    parts.append(user and user["username"])
+    parts.append(flask.request.headers.get("Accept"))
+    parts.append(flask.request.headers.get("Accept-Encoding"))
+    etag = hashlib.sha1(repr(parts).encode("utf-8")).hexdigest()
+    last_modified = datetime.datetime.fromisoformat(db["modified"].rstrip("Z"))
+    last_modified = last_modified.replace(tzinfo=datetime.timezone.utc)
+    mtime = max([s[2] for s in state if s is not None]) / 1e9
+    mtime = datetime.datetime.fromtimestamp(mtime, tz=datetime.timezone.utc)
+    return (etag, max(last_modified, mtime))
+
+
+def set_conditional_headers(response):
+    """Set the validators and cache directives recorded by 'check_not_modified'.
+    A response which may be cached by shared caches varies by the headers
+    that identify the user.
+    """
+    try:
+        etag, last_modified, cache_control = flask.g.conditional
+    except AttributeError:
+        return
+    if response.status_code in (http.client.OK, http.client.NOT_MODIFIED):
+        response.set_etag(etag)
+        response.last_modified = last_modified
+        response.headers["Cache-Control"] = cache_control
+        if cache_control.startswith("public"):
+            # Logged-in users get other cache directives, and maybe content.
+            response.vary.update(["Cookie", "x-apikey"])
+
+
 def set_nrows(db, targets):
     "Set the item 'nrows' for all or given tables and views of the database."
     if not targets:
@@ -1360,78 +1871,336 @@ def _set_nrows(cnx, target):
     target["nrows"] = cnx.execute(sql).fetchone()[0]
 
 
+def stream_tar(db, compression=None):
+    """Yield the chunks of a tar file containing the CSV files of all tables
+    and views in the database, optionally compressed by 'gz' or 'bz2'.
+    The CSV file for each table or view is spooled to a temporary file in
+    a worker thread with its own read connection, so that its size is known
+    for the tar header. Up to EXPORT_WORKERS files are produced in parallel,
+    while the archive is sent in order. A table or view whose CSV output
+    exceeds STREAM_TIMEOUT is skipped.
+    """
+    app = flask.current_app._get_current_object()
+    readonly, profile = get_mode_profile(db["name"])
+    schemas = list(db["tables"].values()) + list(db["views"].values())
+    writer = utils.TarWriter(compression=compression)
+    nworkers = app.config["EXPORT_WORKERS"]
+    futures = []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=nworkers) as executor:
+        try:
+            for pos, schema in enumerate(schemas):
+                # Keep the workers busy with the tables and views coming up.
+                for upcoming in schemas[len(futures) : pos + nworkers]:
+                    futures.append(
+                        executor.submit(
+                            _spool_csv, app, db["name"], upcoming, readonly, profile
+                        )
+                    )
+                outfile = futures[pos].result()
+                if outfile is None:
+                    continue
+                with outfile:
+                    size = outfile.tell()
+                    outfile.seek(0)
+                    name = f"{db['name']}/{schema['name']}.csv"
+                    for chunk in writer.add(name, outfile, size):
+                        if chunk:
+                            yield chunk
+            for chunk in writer.close():
+                if chunk:
+                    yield chunk
+        finally:
+            # Discard any remaining output, e.g. if the client disconnected.
+            for future in futures:
+                if not future.cancel() and future.exception() is None:
+                    if future.result() is not None:
+                        future.result().close()
+
+
+def _spool_csv(app, dbname, schema, readonly, profile):
+    """Write the CSV file for the table or view to a temporary file,
+    and return it positioned at its end. Return None if time-out.
+    Executed in a worker thread, so it uses an app context of its own.
+    """
+    with app.app_context():
+        cnx = utils.get_cnx(dbname, immutable=readonly, profile=profile)
+        columns = [c["name"] for c in schema["columns"]]
+        sql = 'SELECT %s FROM "%s"' % (
+            ",".join([f'"{c}"' for c in columns]),
+            schema["name"],
+        )
+        outfile = tempfile.SpooledTemporaryFile(
+            max_size=app.config["EXPORT_SPOOL_SIZE"]
+        )
+        writer = utils.CsvWriter(header=columns)
+        try:
+            for chunk in writer.stream(utils.iter_timeout(cnx, cnx.execute(sql))):
+                outfile.write(chunk)
+        except SystemError:
+            outfile.close()
+            return None
+        return outfile
+
+
+def write_xlsx(db, outfile):
+    """Write an XLSX workbook with one sheet per table of the database
+    to the given open file. The rows are written as they are read.
+    A table with more rows than a sheet can hold is split across
+    several sheets, named by the table name and a sequence number.
+    The table name is truncated to fit the max length of a sheet title.
+    Raise SystemError if the output exceeds STREAM_TIMEOUT.
+    """
+    wb = openpyxl.Workbook(write_only=True)
+    cnx = get_cnx(db["name"])
+    for table in db["tables"].values():
+        columns = [c["name"] for c in table["columns"]]
+        sql = 'SELECT %s FROM "%s"' % (
+            ",".join([f'"{c}"' for c in columns]),
+            table["name"],
+        )
+        ws = wb.create_sheet(title=table["name"][: constants.XLSX_MAX_TITLE])
+        ws.append(columns)
+        nrows = 1
+        nsheets = 1
+        for row in utils.iter_timeout(cnx, cnx.execute(sql)):
+            if nrows >= constants.XLSX_MAX_ROWS:
+                nsheets += 1
+                suffix = f" ({nsheets})"
+                title = table["name"][: constants.XLSX_MAX_TITLE - len(suffix)]
+                ws = wb.create_sheet(title=title + suffix)
+                ws.append(columns)
+                nrows = 1
+            ws.append(list(row))
+            nrows += 1
+    if not db["tables"]:
+        wb.create_sheet()  # A workbook must contain at least one sheet.
+    wb.save(outfile)
+
+
 def add_sqlite3_database(dbname, infile, size):
     """Add the Sqlite3 database file present in the given open file object.
+    The file is read and written to disk in chunks, while its content hashes
+    are computed, and its integrity is checked before it is added.
     If the database has the metadata of a DbShare Sqlite3 database, check it.
     Else if the database appears to be a plain Sqlite3 database,
     infer the DbShare metadata from it by inspection.
-    'size' is the size of the database file.
+    'size' is the size of the database file, if known.
     Return the database dictionary.
     Raise ValueError if any problem.
     """
+    tmppath = None
     try:
-        check_quota(size=size)
+        check_quota(size=size or 0)
+        with tempfile.NamedTemporaryFile(
+            dir=flask.current_app.config["DATABASES_DIR"],
+            suffix=".upload",
+            delete=False,
+        ) as outfile:
+            tmppath = outfile.name
+            hashes = write_upload(infile, outfile, size=size or 0)
+        has_metadata = check_sqlite3_file(tmppath)
+        signature = get_file_signature(tmppath)
         with DbSaver() as saver:
             dbname = saver.set_name(dbname, modify=True)
-            with open(utils.get_dbpath(dbname), "wb") as outfile:
-                outfile.write(infile.read())
-            saver.initialize()
+            os.replace(tmppath, utils.get_dbpath(dbname))
+            # A DbShare file is not written to, so that the hashes remain valid.
+            if not has_metadata:
+                saver.initialize()
     except (ValueError, TypeError, OSError, IOError, sqlite3.Error) as error:
         raise ValueError(str(error))
+    finally:
+        if tmppath:
+            for suffix in ("",) + SIDECAR_SUFFIXES:
+                try:
+                    os.remove(tmppath + suffix)
+                except FileNotFoundError:
+                    pass
     try:
         with DbSaver(get_db(dbname, complete=True)) as saver:  # Re-read db dict
             if not saver.check_metadata():
                 saver.infer_metadata()
-        return saver.db
     except (ValueError, TypeError, sqlite3.Error) as error:
         delete_database(dbname)
         raise ValueError(str(error))
+    if signature and signature == get_file_signature(utils.get_dbpath(dbname)):
+        save_upload_hashes(dbname, signature, hashes)
+    return saver.db
+
+
+def write_upload(infile, outfile, size=0):
+    """Write the contents of the input file to the output file in chunks
+    of UPLOAD_CHUNK_SIZE bytes. Return the CONTENT_HASHES values for it.
+    The size quota is checked again if more than 'size' bytes are read.
+    Raise ValueError if the size quota is exceeded.
+    """
+    chunk_size = flask.current_app.config["UPLOAD_CHUNK_SIZE"]
+    hashes = {}
+    for hashname in flask.current_app.config["CONTENT_HASHES"]:
+        hashes[hashname] = hashlib.new(hashname)
+    written = 0
+    data = infile.read(chunk_size)
+    while data:
+        outfile.write(data)
+        for hash in hashes.values():
+            hash.update(data)
+        written += len(data)
+        if written > size:
+            check_quota(size=written)
+        data = infile.read(chunk_size)
+    for hashname in hashes:
+        hashes[hashname] = hashes[hashname].hexdigest()
+    return hashes
+
+
+def check_sqlite3_file(filepath):
+    """Check the integrity of the Sqlite3 database file by 'PRAGMA quick_check'.
+    Return True if it contains the DbShare metadata tables.
+    Raise ValueError if any problem.
+    """
+    uri = f"file:{urllib.parse.quote(filepath)}?mode=ro"
+    cnx = sqlite3.connect(uri, uri=True)
+    try:
+        result = [row[0] for row in cnx.execute("PRAGMA quick_check")]
+        if result != ["ok"]:
+            raise ValueError(f"corrupt Sqlite3 file: {result[0]}")
+        sql = "SELECT name FROM sqlite_master WHERE type=?"
+        names = set([row[0] for row in cnx.execute(sql, ("table",))])
+    except sqlite3.DatabaseError as error:
+        raise ValueError(f"invalid Sqlite3 file: {error}")
+    finally:
+        cnx.close()
+    return set([constants.TABLES, constants.INDEXES, constants.VIEWS]) <= names
+
+
+def get_file_signature(filepath):
+    """Return the size, modification time and Sqlite3 file change counter
+    of the database file. Any write to the file changes its signature.
+    Return None if the file is in WAL mode, since it will be changed
+    when it is set to read-only mode.
+    """
+    info = os.stat(filepath)
+    with open(filepath, "rb") as infile:
+        header = infile.read(100)
+    if header[18:20] == b"\x02\x02":
+        return None
+    return [info.st_size, info.st_mtime_ns, header[24:28].hex()]
+
+
+def save_upload_hashes(dbname, signature, hashes):
+    """Save the content hashes computed when the database file was uploaded,
+    with the signature of the file, in a file next to the database file.
+    """
+    with open(utils.get_dbpath(dbname) + HASHES_SUFFIX, "w") as outfile:
+        json.dump({"signature": signature, "hashes": hashes}, outfile)
+
+
+def pop_upload_hashes(dbname):
+    """Return the content hashes computed when the database file was uploaded,
+    if the file is unchanged since then, else None. Remove the saved hashes.
+    """
+    dbpath = utils.get_dbpath(dbname)
+    try:
+        with open(dbpath + HASHES_SUFFIX) as infile:
+            data = json.load(infile)
+        os.remove(dbpath + HASHES_SUFFIX)
+    except (OSError, ValueError):
+        return None
+    if set(data["hashes"]) != set(flask.current_app.config["CONTENT_HASHES"]):
+        return None
+    # Anything in a write-ahead log or journal is not yet in the file.
+    for suffix in SIDECAR_SUFFIXES:
+        if os.path.exists(dbpath + suffix):
+            return None
+    if data["signature"] != get_file_signature(dbpath):
+        return None
+    return data["hashes"]
 
 
 def add_xlsx_database(dbname, infile, size):
     """Add the XLSX file workbook as a database.
-    The worksheets are loaded as tables.
+    The worksheets are loaded as tables; empty worksheets are skipped.
+    The workbook is opened read-only, and the rows of each worksheet
+    are read and loaded in batches, not all at once.
     'size' is the size of the XLSX file.
     Return the database dictionary.
     Raise ValueError if any problem.
     """
-    tmp = tempfile.NamedTemporaryFile(suffix=".xlsx")
-    tmp.write(infile.read())
-    tmp.seek(0)
     try:
-        wb = openpyxl.load_workbook(tmp.name)
         check_quota(size=size)
+        # The workbook is a zip file, which must be seekable.
+        if not infile.seekable():
+            tmp = tempfile.TemporaryFile(suffix=".xlsx")
+            shutil.copyfileobj(infile, tmp)
+            tmp.seek(0)
+            infile = tmp
+        wb = openpyxl.load_workbook(infile, read_only=True, data_only=True)
+    except (ValueError, IOError, KeyError, zipfile.BadZipFile) as error:
+        raise ValueError(str(error))
+    try:
         with DbSaver() as saver:
             dbname = saver.set_name(dbname)
             saver.initialize()
         db = get_db(dbname, complete=True)
     except (ValueError, IOError) as error:
+        wb.close()
         raise ValueError(str(error))
-    for sheet in wb:
-        # Ensure the table name is unique.
-        tname = utils.name_cleaned(sheet.title)
-        tablename = tname
-        count = 1
-        while tablename in db["tables"]:
-            count += 1
-            tablename = f"{tname}{count}"
-        records = list(sheet.values)
-        # The header determines the number of columns;
-        # clip off any trailing None values.
-        for pos, item in enumerate(records[0]):
-            if item is None:
-                records[0] = records[0][:pos]
-                break
-
-        # Truncate records to same number of items as header; convert to lists.
-        # Convert records from tuples to lists.
-        length = len(records[0])
-        records = [list(r[:length]) for r in records]
-        with DbSaver(db) as saver:
-            saver.create_table_load_records(tablename, records)
+    try:
+        for sheet in wb:
+            # Do not trust the dimensions recorded in the file; may be wrong.
+            sheet.reset_dimensions()
+            rows = sheet.iter_rows(values_only=True)
+            try:
+                header = next(rows)
+            except StopIteration:
+                continue
+            # The header determines the number of columns;
+            # clip off any trailing None values.
+            if None in header:
+                header = header[: header.index(None)]
+            if not header:
+                continue
+            # Ensure the table name is unique.
+            tname = utils.name_cleaned(sheet.title)
+            tablename = tname
+            count = 1
+            while tablename in db["tables"]:
+                count += 1
+                tablename = f"{tname}{count}"
+            records = functools.partial(get_xlsx_records, sheet, header)
+            with DbSaver(db) as saver:
+                saver.create_table_load_records(tablename, records)
+    except (ValueError, TypeError, sqlite3.Error) as error:
+        delete_database(dbname)
+        raise ValueError(str(error))
+    finally:
+        wb.close()
     return db
 
 
+def get_xlsx_records(sheet, header):
+    """Yield the header, and then the following rows of the XLSX worksheet
+    as records of the same length as the header. Rows are truncated or
+    padded with None as needed.
+    The native values of numeric cells are kept as they are; date and time
+    values are changed to text in ISO format. Empty string values are
+    changed to None, and rows without any values are skipped.
+    """
+    yield header
+    length = len(header)
+    for row in sheet.iter_rows(min_row=2, values_only=True):
+        record = [None] * length
+        empty = True
+        for i, value in enumerate(row[:length]):
+            if value is None or value == "":
+                continue
+            if isinstance(value, (datetime.date, datetime.time, datetime.timedelta)):
+                value = str(value)
+            record[i] = value
+            empty = False
+        if not empty:
+            yield record
+
+
 def delete_database(dbname):
     "Delete the database in the system database and from disk."
     cnx = utils.get_cnx(write=True)
@@ -1440,8 +2209,12 @@ def delete_database(dbname):
         cnx.execute(sql, (dbname,))
         sql = "DELETE FROM dbs WHERE name=?"
         cnx.execute(sql, (dbname,))
-    try:
-        os.remove(utils.get_dbpath(dbname))
-    except FileNotFoundError:
-        pass
+    dbshare.pool.invalidate(dbname)
+    dbshare.metadata.invalidate(dbname)
+    dbpath = utils.get_dbpath(dbname)
+    for suffix in ("",) + SIDECAR_SUFFIXES + (HASHES_SUFFIX,):
+        try:
+            os.remove(dbpath + suffix)
+        except FileNotFoundError:
+            pass
     
@@ -1,5 +1,6 @@
 "Database lists HTML endpoints."
 
+import json
 import os.path
 
 import flask
@@ -10,6 +11,9 @@ from dbshare import utils
 
 blueprint = flask.Blueprint("dbs", __name__)
 
+# Columns by which the list of databases may be sorted.
+SORT_COLUMNS = ("name", "owner", "size", "created", "modified")
+
 
 @blueprint.route("/upload", methods=["GET", "POST"])
 @utils.login_required
@@ -42,16 +46,30 @@ def upload():
 @blueprint.route("/public")
 def public():
     "Display the list of public databases."
-    return flask.render_template("dbs/public.html", dbs=get_dbs(public=True))
+    try:
+        dbs, next_args = get_dbs_page(public=True)
+    except ValueError as error:
+        utils.flash_error(error)
+        return flask.redirect(flask.url_for("home"))
+    return flask.render_template(
+        "dbs/public.html", dbs=dbs, next_url=get_next_url(next_args)
+    )
 
 
 @blueprint.route("/all")
 @utils.admin_required
 def all():
     "Display the list of all databases."
-    dbs = get_dbs()
+    try:
+        dbs, next_args = get_dbs_page()
+    except ValueError as error:
+        utils.flash_error(error)
+        return flask.redirect(flask.url_for("home"))
     return flask.render_template(
-        "dbs/all.html", dbs=dbs, total_size=sum([db["size"] for db in dbs])
+        "dbs/all.html",
+        dbs=dbs,
+        total_size=dbshare.db.get_usage()[1],
+        next_url=get_next_url(next_args),
     )
 
 
@@ -65,22 +83,31 @@ def owner(username=""):
     elif not has_access(username):
         utils.flash_error("you may not access the list of the user's databases")
         return flask.redirect(flask.url_for("home"))
-    dbs = get_dbs(owner=username)
+    try:
+        dbs, next_args = get_dbs_page(owner=username)
+    except ValueError as error:
+        utils.flash_error(error)
+        return flask.redirect(flask.url_for("home"))
     return flask.render_template(
         "dbs/owner.html",
         dbs=dbs,
-        total_size=sum([db["size"] for db in dbs]),
+        total_size=dbshare.db.get_usage(username)[1],
         username=username,
+        next_url=get_next_url(next_args),
     )
 
 
 @blueprint.route("/lookup/<hashcode>")
 def lookup(hashcode):
     "Lookup and redirect to the database with the given hash."
-    for db in get_dbs(readonly=True):
-        for hashvalue in db["hashes"].values():
-            if hashvalue == hashcode:
-                return flask.redirect(flask.url_for("db.display", dbname=db["name"]))
+    sql = (
+        "SELECT dbs.name FROM dbs, dbs_hashes"
+        " WHERE dbs_hashes.hashvalue=? AND dbs.name=dbs_hashes.name"
+        " AND dbs.readonly=1"
+    )
+    row = flask.g.syscnx.execute(sql, (hashcode,)).fetchone()
+    if row is not None:
+        return flask.redirect(flask.url_for("db.display", dbname=row[0]))
     utils.flash_error("no such database")
     return flask.redirect(flask.url_for("home"))
 
@@ -90,9 +117,33 @@ def has_access(username):
     return flask.g.is_admin or flask.g.current_user["username"] == username
 
 
-def get_dbs(public=None, owner=None, complete=False, readonly=None):
-    "Get the list of databases according to criteria."
-    sql = "SELECT name FROM dbs"
+def get_dbs(
+    public=None,
+    owner=None,
+    complete=False,
+    readonly=None,
+    sort="name",
+    limit=None,
+    after=None,
+):
+    """Get the list of databases according to criteria.
+    Sort by the given column; descending if the name is prefixed by '-'.
+    If 'limit' is given, return at most that many databases.
+    If 'after' is given, return the databases following the one
+    with that name in the sort order.
+    Raise ValueError if invalid sort column.
+    """
+    descending = sort.startswith("-")
+    column = sort.lstrip("-")
+    if column not in SORT_COLUMNS:
+        raise ValueError("invalid sort column")
+    sql = (
+        "SELECT name, owner, title, description, public, readonly, profile,"
+        " size, created, modified,"
+        " (SELECT json_group_object(hashname, hashvalue) FROM dbs_hashes"
+        "  WHERE dbs_hashes.name=dbs.name) AS hashes"
+        " FROM dbs"
+    )
     criteria = {}
     if public is not None:
         criteria["public=?"] = public
@@ -100,9 +151,72 @@ def get_dbs(public=None, owner=None, complete=False, readonly=None):
         criteria["owner=?"] = owner
     if readonly is not None:
         criteria["readonly=?"] = readonly
+    values = list(criteria.values())
+    clauses = []
     if criteria:
-        sql += " WHERE " + " OR ".join(criteria.keys())
-    return [
-        dbshare.db.get_db(row[0], complete=complete)
-        for row in flask.g.syscnx.execute(sql, tuple(criteria.values()))
-    ]
+        clauses.append("(" + " OR ".join(criteria.keys()) + ")")
+    if after:
+        if column == "name":
+            clauses.append("name %s ?" % (descending and "<" or ">"))
+            values.append(after)
+        else:
+            clauses.append(
+                f"({column}, name) %s ((SELECT {column} FROM dbs WHERE name=?), ?)"
+                % (descending and "<" or ">")
+            )
+            values.extend([after, after])
+    if clauses:
+        sql += " WHERE " + " AND ".join(clauses)
+    order = descending and "DESC" or "ASC"
+    if column == "name":
+        sql += f" ORDER BY name {order}"
+    else:
+        sql += f" ORDER BY {column} {order}, name {order}"
+    if limit is not None:
+        sql += " LIMIT ?"
+        values.append(limit)
+    result = []
+    for row in flask.g.syscnx.execute(sql, values):
+        if complete:
+            result.append(dbshare.db.get_db(row["name"], complete=True))
+        else:
+            db = dict(row)
+            db["public"] = bool(db["public"])
+            db["readonly"] = bool(db["readonly"])
+            db["hashes"] = json.loads(db["hashes"] or "{}")
+            result.append(db)
+    return result
+
+
+def get_dbs_page(**criteria):
+    """Get a page of the list of databases according to criteria,
+    using the request arguments 'sort', 'limit' and 'after'.
+    Return the list, and the arguments for the next page, or None if none.
+    Raise ValueError if invalid arguments.
+    """
+    sort = flask.request.args.get("sort") or "name"
+    try:
+        limit = int(
+            flask.request.args.get("limit") or flask.current_app.config["DBS_PAGE_SIZE"]
+        )
+        if limit <= 0:
+            raise ValueError
+    except ValueError:
+        raise ValueError("invalid limit")
+    after = flask.request.args.get("after")
+    dbs = get_dbs(sort=sort, limit=limit + 1, after=after, **criteria)
+    if len(dbs) > limit:
+        dbs = dbs[:limit]
+        return dbs, dict(sort=sort, limit=limit, after=dbs[-1]["name"])
+    return dbs, None
+
+
+def get_next_url(next_args, external=False):
+    "Return the URL for the next page of the current endpoint, or None if none."
+    if next_args is None:
+        return None
+    kwargs = dict(flask.request.view_args)
+    kwargs.update(next_args)
+    if external:
+        return utils.url_for(flask.request.endpoint, **kwargs)
+    return flask.url_for(flask.request.endpoint, **kwargs)
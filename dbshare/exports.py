@@ -0,0 +1,277 @@
+"On-disk cache of exported files of read-only databases, keyed by content hash."
+
+import hashlib
+import os
+import os.path
+import tempfile
+import threading
+
+import flask
+
+import dbshare.compression
+
+
+class ExportCache:
+    """LRU cache of exported files in a directory, bounded by total size.
+    A file is named by the content hash of the database it was produced
+    from, followed by a digest of the format and options that produced it.
+    The modification time of a file records when it was last used.
+    The directory may be shared by several processes.
+    """
+
+    def __init__(self, dirpath, max_size):
+        self.dirpath = dirpath
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get_filepath(self, key):
+        "Return the path of the file for the key; (hashvalue, format, options)."
+        hashvalue, format, options = key
+        digest = hashlib.sha1(repr((format, options)).encode("utf-8")).hexdigest()
+        return os.path.join(self.dirpath, f"{hashvalue}-{digest}.{format}")
+
+    def get_variant_key(self, key, encoding):
+        "Return the key for the file of the key compressed by the encoding."
+        hashvalue, format, options = key
+        ext = dbshare.compression.EXTENSIONS[encoding]
+        return (hashvalue, f"{format}.{ext}", options)
+
+    def get(self, key):
+        """Return the cached file for the key opened for reading, or None.
+        Once open, the file remains readable even if it is evicted.
+        """
+        filepath = self.get_filepath(key)
+        try:
+            infile = open(filepath, "rb")
+            os.utime(filepath)  # Mark as recently used.
+        except OSError:
+            with self.lock:
+                self.misses += 1
+            return None
+        with self.lock:
+            self.hits += 1
+        return infile
+
+    def store(self, key, chunks):
+        """Yield the given chunks, while writing them to a temporary file
+        which is added to the cache if all chunks were produced.
+        """
+        os.makedirs(self.dirpath, exist_ok=True)
+        fd, tmppath = tempfile.mkstemp(dir=self.dirpath, prefix=".")
+        try:
+            with os.fdopen(fd, "wb") as outfile:
+                for chunk in chunks:
+                    outfile.write(chunk)
+                    yield chunk
+        except BaseException:  # Includes GeneratorExit; client disconnected.
+            os.remove(tmppath)
+            raise
+        self.add(key, tmppath)
+
+    def add(self, key, tmppath):
+        "Add the complete file at the temporary path to the cache."
+        os.replace(tmppath, self.get_filepath(key))
+        self.evict()
+
+    def create(self, key, write):
+        """Call 'write' with an open file to produce the file for the key,
+        add it to the cache, and return it opened for reading.
+        """
+        os.makedirs(self.dirpath, exist_ok=True)
+        fd, tmppath = tempfile.mkstemp(dir=self.dirpath, prefix=".")
+        try:
+            with os.fdopen(fd, "wb") as outfile:
+                write(outfile)
+        except BaseException:
+            os.remove(tmppath)
+            raise
+        infile = open(tmppath, "rb")
+        self.add(key, tmppath)
+        return infile
+
+    def evict(self):
+        "Remove the least recently used files until within the max size."
+        entries = []
+        total = 0
+        for entry in os.scandir(self.dirpath):
+            if entry.name.startswith("."):  # Temporary file being written.
+                continue
+            try:
+                stat = entry.stat()
+            except OSError:  # Removed by another process.
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+            total += stat.st_size
+        entries.sort()
+        for mtime, size, filepath in entries:
+            if total <= self.max_size:
+                break
+            try:
+                os.remove(filepath)
+            except OSError:
+                pass
+            total -= size
+            with self.lock:
+                self.evictions += 1
+
+    def purge(self, hashvalue):
+        "Remove all files produced from the database with the content hash."
+        try:
+            entries = list(os.scandir(self.dirpath))
+        except OSError:  # No directory; nothing cached.
+            return
+        for entry in entries:
+            if entry.name.startswith(f"{hashvalue}-"):
+                try:
+                    os.remove(entry.path)
+                except OSError:
+                    pass
+
+    def get_stats(self):
+        "Return the current counts for the cache."
+        with self.lock:
+            return dict(
+                max_size=self.max_size,
+                hits=self.hits,
+                misses=self.misses,
+                evictions=self.evictions,
+            )
+
+
+# The process-wide cache instance; set in 'init'. None if disabled.
+cache = None
+
+
+def init(app):
+    "Set up the export cache according to the configuration."
+    global cache
+    if app.config["EXPORT_CACHE_MAX_SIZE"]:
+        dirpath = app.config["EXPORT_CACHE_DIR"] or os.path.join(
+            app.config["DATABASES_DIR"], "_exports"
+        )
+        cache = ExportCache(dirpath, app.config["EXPORT_CACHE_MAX_SIZE"])
+    else:
+        cache = None
+
+
+def get_key(db, format, **options):
+    """Return the cache key for the export of the database in the given
+    format with the given options, or None if it is not to be cached,
+    which is the case unless the database is read-only.
+    """
+    if cache is None or not db["readonly"]:
+        return None
+    for hashname in flask.current_app.config["CONTENT_HASHES"]:
+        try:
+            hashvalue = db["hashes"][hashname]
+        except KeyError:
+            pass
+        else:
+            options["dbname"] = db["name"]
+            return (hashvalue, format, sorted(options.items()))
+    return None
+
+
+def get(key):
+    "Return the cached file for the key opened for reading, or None."
+    if key is None:
+        return None
+    return cache.get(key)
+
+
+def store(key, chunks):
+    "Yield the given chunks, adding them to the cache as a file if a key."
+    if key is None:
+        return chunks
+    return cache.store(key, chunks)
+
+
+def create(key, write):
+    """Call 'write' with an open file to produce the file for the key,
+    and return it opened for reading. It is added to the cache if a key.
+    """
+    if key is None:
+        outfile = tempfile.TemporaryFile()
+        try:
+            write(outfile)
+        except BaseException:
+            outfile.close()
+            raise
+        outfile.seek(0)
+        return outfile
+    return cache.create(key, write)
+
+
+def send(key, infile, mimetype, filename=None):
+    """Return the response for the cached file for the key opened by 'get'.
+    If the client accepts a compressed response, the precompressed variant
+    of the file is sent; it is produced and added to the cache if needed.
+    If EXPORT_CACHE_ACCEL_URL is set, the reverse proxy is asked to send
+    the file from that location.
+    """
+    encoding = dbshare.compression.get_encoding(
+        mimetype, os.fstat(infile.fileno()).st_size
+    )
+    if encoding:
+        variant_key = cache.get_variant_key(key, encoding)
+        compressed = cache.get(variant_key)
+        if compressed is None:
+            # Compress while sending, adding the result to the cache.
+            chunks = cache.store(
+                variant_key,
+                dbshare.compression.compress(encoding, _read_chunks(infile)),
+            )
+            response = flask.Response(
+                flask.stream_with_context(chunks), mimetype=mimetype
+            )
+        else:
+            infile.close()
+            response = _send_file(compressed, mimetype)
+    else:
+        response = _send_file(infile, mimetype)
+    dbshare.compression.set_encoding(response, encoding)
+    if filename:
+        response.headers.set("Content-Disposition", "attachment", filename=filename)
+    return response
+
+
+def _send_file(infile, mimetype):
+    "Return the response sending the cached file, or asking the proxy to."
+    accel_url = flask.current_app.config["EXPORT_CACHE_ACCEL_URL"]
+    if accel_url:
+        infile.close()
+        response = flask.Response(mimetype=mimetype)
+        response.headers["X-Accel-Redirect"] = (
+            accel_url.rstrip("/") + "/" + os.path.basename(infile.name)
+        )
+        return response
+    return flask.send_file(infile, mimetype=mimetype, etag=False)
+
+
+def _read_chunks(infile):
+    "Yield the contents of the file in chunks, and close it."
+    chunk_size = flask.current_app.config["STREAM_CHUNK_SIZE"]
+    with infile:
+        while True:
+            chunk = infile.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+
+
+def purge(db):
+    "Remove all cached files for the read-only database."
+    if cache is None:
+        return
+    for hashvalue in db["hashes"].values():
+        cache.purge(hashvalue)
+
+
+def get_stats():
+    "Return the current counts for the cache, or None if disabled."
+    if cache is None:
+        return None
+    return cache.get_stats()
@@ -7,8 +7,12 @@ import dbshare
 import dbshare.about
 import dbshare.doc
 import dbshare.config
+import dbshare.compression
 import dbshare.db
 import dbshare.dbs
+import dbshare.exports
+import dbshare.metadata
+import dbshare.pool
 import dbshare.query
 import dbshare.site
 import dbshare.system
@@ -47,6 +51,9 @@ app.add_template_filter(utils.mode)
 dbshare.config.init(app)
 
 # Initialize the subsystems.
+dbshare.pool.init(app)
+dbshare.metadata.init(app)
+dbshare.exports.init(app)
 dbshare.system.init(app)
 dbshare.doc.init(app)
 
@@ -83,12 +90,45 @@ def prepare():
     flask.g.timer = utils.Timer()
 
 
+@app.after_request
+def finish(response):
+    """Set the headers for conditional requests, if the access produced any.
+    Compress the response, if suitable.
+    """
+    dbshare.db.set_conditional_headers(response)
+    return dbshare.compression.compress_response(response)
+
+
+@app.teardown_request
+def report(exception):
+    "Log the number of database connections checked out by the access."
+    if flask.g.get("dbcnx_checkouts"):
+        app.logger.debug(
+            f"{flask.request.method} {flask.request.path}:"
+            f" {flask.g.dbcnx_checkouts} database connection(s) checked out"
+        )
+
+
+@app.teardown_appcontext
+def finalize(exception):
+    "Return the database connections to the pool after every access."
+    flask.g.pop("dbcnxs", None)
+    utils.release_cnxs()
+
+
 @app.route("/")
 def home():
     "Home page; display the list of public databases."
     if utils.accept_json():
         return flask.redirect(flask.url_for("api.root"))
-    return flask.render_template("home.html", dbs=dbshare.dbs.get_dbs(public=True))
+    try:
+        dbs, next_args = dbshare.dbs.get_dbs_page(public=True)
+    except ValueError as error:
+        utils.flash_error(error)
+        return flask.redirect(flask.url_for("home"))
+    return flask.render_template(
+        "home.html", dbs=dbs, next_url=dbshare.dbs.get_next_url(next_args)
+    )
 
 
 @app.route("/status")
@@ -104,7 +144,15 @@ def status():
         n_users = rows[0][0]
     else:
         n_users = 0
-    return dict(status="ok", n_dbs=n_dbs, n_users=n_users)
+    return dict(
+        status="ok",
+        n_dbs=n_dbs,
+        n_users=n_users,
+        cnx_pool=dbshare.pool.get_stats(),
+        metadata_cache=dbshare.metadata.get_stats(),
+        export_cache=dbshare.exports.get_stats(),
+        user_cache=dbshare.user.get_user_cache_stats(),
+    )
 
 
 # Set up the URL map.
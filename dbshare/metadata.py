@@ -0,0 +1,157 @@
+"Process-wide cache of database metadata, validated against the database files."
+
+import collections
+import marshal
+import os
+import threading
+
+
+class MetadataCache:
+    """LRU cache of database metadata dictionaries, keyed by database name.
+    An entry is valid only for the 'version' it was read at; the state
+    (inode, size, modification time) of the files it was read from.
+    The 'PRAGMA data_version' value seen by each connection that has used
+    an entry is also recorded, which catches commits by other connections
+    that were done too close in time to change the files' state.
+    Entries are kept serialized, and each lookup returns a new copy,
+    so callers may modify what they get without corrupting the cache.
+    """
+
+    def __init__(self, max_size=128):
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        # name -> (version, data_versions, base, schemas); most recent last.
+        self.entries = collections.OrderedDict()
+        # Incremented for a database name when its entry is invalidated.
+        self.generations = {}
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def get(self, name, version, data_versions, complete=False):
+        """Return a copy of the metadata for the database, or None if
+        there is no valid entry. The 'data_versions' is a dictionary
+        of id(cnx) -> 'PRAGMA data_version' for the connections used.
+        If 'complete', the entry must contain the tables, indexes and views.
+        """
+        with self.lock:
+            entry = self.entries.get(name)
+            if (
+                entry is None
+                or entry[0] != version
+                or (complete and entry[3] is None)
+                or any(
+                    [entry[1].get(k, v) != v for k, v in data_versions.items()]
+                )
+            ):
+                self.misses += 1
+                return None
+            entry[1].update(data_versions)
+            self.entries.move_to_end(name)
+            self.hits += 1
+        db = marshal.loads(entry[2])
+        if complete:
+            db.update(marshal.loads(entry[3]))
+        return db
+
+    def put(self, name, version, data_versions, db, generation):
+        """Store the metadata for the database, read at the given version.
+        Not done if the entry has been invalidated after 'generation'
+        was obtained, since the metadata may then be out of date.
+        """
+        base = dict(
+            [(k, v) for k, v in db.items() if k not in ("tables", "indexes", "views")]
+        )
+        base = marshal.dumps(base)
+        if "tables" in db:
+            schemas = marshal.dumps(
+                dict(tables=db["tables"], indexes=db["indexes"], views=db["views"])
+            )
+        else:
+            schemas = None
+        with self.lock:
+            if generation != self.generations.get(name, 0):
+                return
+            self.entries[name] = (version, dict(data_versions), base, schemas)
+            self.entries.move_to_end(name)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def get_generation(self, name):
+        "Return the current generation for the database; to be given to 'put'."
+        with self.lock:
+            return self.generations.get(name, 0)
+
+    def invalidate(self, name):
+        "Remove the entry for the database. To be done when it has been modified."
+        with self.lock:
+            self.generations[name] = self.generations.get(name, 0) + 1
+            self.entries.pop(name, None)
+            self.invalidations += 1
+
+    def get_stats(self):
+        "Return the current counts for the cache."
+        with self.lock:
+            return dict(
+                size=len(self.entries),
+                max_size=self.max_size,
+                hits=self.hits,
+                misses=self.misses,
+                invalidations=self.invalidations,
+            )
+
+
+# The process-wide cache instance; replaced in 'init'.
+cache = MetadataCache()
+
+
+def init(app):
+    "Set up the metadata cache according to the configuration."
+    global cache
+    cache = MetadataCache(max_size=app.config["METADATA_CACHE_SIZE"])
+
+
+def get_file_state(filepath):
+    """Return the state of the Sqlite3 database file and its write-ahead log,
+    if any, as a tuple of (inode, size, modification time) tuples.
+    Raise OSError if no such database file.
+    """
+    result = os.stat(filepath)
+    result = [(result.st_ino, result.st_size, result.st_mtime_ns)]
+    try:
+        wal = os.stat(filepath + "-wal")
+    except OSError:
+        result.append(None)
+    else:
+        result.append((wal.st_ino, wal.st_size, wal.st_mtime_ns))
+    return tuple(result)
+
+
+def get_data_version(cnx):
+    "Return the value that changes when another connection commits to the database."
+    return cnx.execute("PRAGMA data_version").fetchone()[0]
+
+
+def get(name, version, data_versions, complete=False):
+    "Return a copy of the metadata for the database, or None if no valid entry."
+    return cache.get(name, version, data_versions, complete=complete)
+
+
+def put(name, version, data_versions, db, generation):
+    "Store the metadata for the database, unless invalidated after 'generation'."
+    cache.put(name, version, data_versions, db, generation)
+
+
+def get_generation(name):
+    "Return the current generation for the database; to be given to 'put'."
+    return cache.get_generation(name)
+
+
+def invalidate(name):
+    "Remove the entry for the database from the cache."
+    cache.invalidate(name)
+
+
+def get_stats():
+    "Return the current counts for the cache."
+    return cache.get_stats()
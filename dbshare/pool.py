@@ -0,0 +1,157 @@
+"Process-wide pool of Sqlite3 connections, reused between requests."
+
+import sqlite3
+import threading
+import time
+
+
+class ConnectionPool:
+    """Pool of idle Sqlite3 connections keyed by (database name, mode).
+    A connection is checked out for the exclusive use of one request,
+    and is returned to the pool when that request is finished.
+    Idle connections are closed when unused for more than 'max_idle' seconds,
+    and the least recently used ones when there are more than 'max_size'.
+    An idle connection is also closed if the identity of its database file
+    has changed, which catches renames, deletions and mode changes done
+    by other processes.
+    """
+
+    def __init__(self, max_size=32, max_idle=300.0):
+        self.max_size = max_size
+        self.max_idle = max_idle
+        self.lock = threading.Lock()
+        # Idle entries (key, cnx, generation, released, identity), most recent last.
+        self.idle = []
+        # Checked-out connections: id(cnx) -> (key, generation, identity).
+        self.checked_out = {}
+        # Incremented for a database name when its connections are invalid.
+        self.generations = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def acquire(self, key, connect, identity=None):
+        """Check out a connection for the key (dbname, mode).
+        An idle connection is reused only if it was opened for the same
+        file 'identity'. Otherwise call 'connect' to get a new one.
+        """
+        closing = []
+        with self.lock:
+            for pos in range(len(self.idle) - 1, -1, -1):
+                if self.idle[pos][0] == key:
+                    entry = self.idle.pop(pos)
+                    if entry[4] == identity:
+                        cnx = entry[1]
+                        self.hits += 1
+                        break
+                    closing.append(entry[1])
+                    self.evictions += 1
+            else:
+                cnx = None
+                self.misses += 1
+            generation = self.generations.get(key[0], 0)
+        for stale in closing:
+            stale.close()
+        if cnx is None:
+            cnx = connect()
+        with self.lock:
+            self.checked_out[id(cnx)] = (key, generation, identity)
+        return cnx
+
+    def release(self, cnx):
+        """Return the checked-out connection to the pool.
+        Any transaction not committed is rolled back.
+        The connection is closed if it has been invalidated.
+        """
+        with self.lock:
+            try:
+                key, generation, identity = self.checked_out.pop(id(cnx))
+            except KeyError:  # Not from this pool, or already released.
+                return
+            current = generation == self.generations.get(key[0], 0)
+        try:
+            if cnx.in_transaction:
+                cnx.rollback()
+        except sqlite3.ProgrammingError:  # Closed by the user.
+            return
+        if not current:
+            cnx.close()
+            return
+        now = time.monotonic()
+        with self.lock:
+            self.idle.append((key, cnx, generation, now, identity))
+            closing = self._trim(now)
+        for cnx in closing:
+            cnx.close()
+
+    def invalidate(self, dbname):
+        """Close the idle connections to the database, and make sure that
+        those currently checked out are closed when released.
+        To be done when the database file is renamed, deleted or its mode changed.
+        """
+        with self.lock:
+            self.generations[dbname] = self.generations.get(dbname, 0) + 1
+            self.invalidations += 1
+            closing = [e[1] for e in self.idle if e[0][0] == dbname]
+            self.idle = [e for e in self.idle if e[0][0] != dbname]
+        for cnx in closing:
+            cnx.close()
+
+    def _trim(self, now):
+        """Remove idle connections that are too old, or too many.
+        Return the list of connections to close. Must be called with lock held.
+        """
+        closing = []
+        while self.idle and (
+            len(self.idle) > self.max_size or now - self.idle[0][3] > self.max_idle
+        ):
+            closing.append(self.idle.pop(0)[1])
+            self.evictions += 1
+        return closing
+
+    def get_stats(self):
+        "Return the current counts for the pool."
+        with self.lock:
+            return dict(
+                idle=len(self.idle),
+                checked_out=len(self.checked_out),
+                max_size=self.max_size,
+                hits=self.hits,
+                misses=self.misses,
+                evictions=self.evictions,
+                invalidations=self.invalidations,
+            )
+
+
+# The process-wide pool instance; replaced in 'init'.
+pool = ConnectionPool()
+
+
+def init(app):
+    "Set up the connection pool according to the configuration."
+    global pool
+    pool = ConnectionPool(
+        max_size=app.config["CNX_POOL_MAX_SIZE"],
+        max_idle=app.config["CNX_POOL_MAX_IDLE"],
+    )
+
+
+def acquire(key, connect, identity=None):
+    "Check out a connection for the key (dbname, mode) from the pool."
+    return pool.acquire(key, connect, identity=identity)
+
+
+def release(cnx):
+    "Return the connection to the pool."
+    pool.release(cnx)
+
+
+def invalidate(dbname):
+    "Close all pooled connections to the database, now or when released."
+    pool.invalidate(dbname)
+
+
+def get_stats():
+    "Return the current counts for the pool."
+    return pool.get_stats()
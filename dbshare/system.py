@@ -55,6 +55,8 @@ SYSTEM_TABLES = [
             dict(name="description", type=constants.TEXT),
             dict(name="public", type=constants.INTEGER, notnull=True),
             dict(name="readonly", type=constants.INTEGER, notnull=True),
+            dict(name="profile", type=constants.TEXT),
+            dict(name="size", type=constants.INTEGER),
             dict(name="created", type=constants.TEXT, notnull=True),
             dict(name="modified", type=constants.TEXT, notnull=True),
         ],
@@ -84,6 +86,8 @@ SYSTEM_INDEXES = [
     dict(name="users_email", table="users", columns=["email"], unique=True),
     dict(name="users_apikey", table="users", columns=["apikey"]),
     dict(name="users_logs_username", table="users_logs", columns=["username"]),
+    dict(name="dbs_owner", table="dbs", columns=["owner"]),
+    dict(name="dbs_hashes_name", table="dbs_hashes", columns=["name"]),
     dict(name="dbs_logs_id", table="dbs_logs", columns=["name"]),
 ]
 
@@ -95,6 +99,28 @@ def init(app):
     for schema in SYSTEM_TABLES:
         sql = dbshare.db.get_sql_create_table(schema, if_not_exists=True)
         cnx.execute(sql)
+        # Add any columns introduced after the table was created.
+        sql = f"""PRAGMA table_info("{schema['name']}")"""
+        existing = set([row[1] for row in cnx.execute(sql)])
+        for column in schema["columns"]:
+            if column["name"] not in existing:
+                sql = (
+                    f'''ALTER TABLE "{schema['name']}"'''
+                    f""" ADD COLUMN "{column['name']}" {column['type']}"""
+                )
+                cnx.execute(sql)
+    # Set the size of databases lacking it; column added after creation.
+    sql = "SELECT name FROM dbs WHERE size IS NULL"
+    for (dbname,) in cnx.execute(sql).fetchall():
+        dbpath = os.path.join(app.config["DATABASES_DIR"], f"{dbname}.sqlite3")
+        size = 0
+        for path in [dbpath, dbpath + "-wal"]:
+            try:
+                size += os.path.getsize(path)
+            except OSError:
+                pass
+        with cnx:
+            cnx.execute("UPDATE dbs SET size=? WHERE name=?", (size, dbname))
     for schema in SYSTEM_INDEXES:
         sql = dbshare.db.get_sql_create_index(
             schema["table"], schema, if_not_exists=True
@@ -9,6 +9,7 @@ import statistics as statistics_module
 import flask
 
 import dbshare.db
+import dbshare.exports
 
 from dbshare import constants
 from dbshare import utils
@@ -93,18 +94,28 @@ def rows(dbname, tablename):
         utils.flash_error("no such table")
         return flask.redirect(flask.url_for("db.display", dbname=dbname))
     try:
-        columns = [c["name"] for c in schema["columns"]]
-        dbcnx = dbshare.db.get_cnx(dbname)
-        colnames = ",".join([f'"{c}"' for c in columns])
-        sql = f'SELECT rowid, {colnames} FROM "{tablename}"'
-        limit = flask.current_app.config["MAX_NROWS_DISPLAY"]
-        if schema.get("nrows", 0) > limit:
-            sql += f" LIMIT {limit}"
-            utils.flash_message_limit(limit)
-        cursor = utils.execute_timeout(dbcnx, sql)
+        page = get_display_page_args()
+        # The rowid is needed for the edit links.
+        columns = ["rowid"] + [c["name"] for c in schema["columns"]]
+        rows, after = utils.get_rows_page(
+            dbshare.db.get_cnx(dbname),
+            tablename,
+            columns,
+            page["limit"],
+            after=page["after"],
+            keys=dbshare.db.get_row_keys(db, schema),
+        )
+    except ValueError as error:
+        utils.flash_error(error)
+        return flask.redirect(
+            flask.url_for(".rows", dbname=dbname, tablename=tablename)
+        )
     except (SystemError, sqlite3.Error) as error:
         utils.flash_error(error)
-        return flask.redirect(flask.url_for(".schema", tablename=tablename))
+        return flask.redirect(
+            flask.url_for(".schema", dbname=dbname, tablename=tablename)
+        )
+    page["next"] = after
     views = []
     for viewname, view in db["views"].items():
         if tablename in view["sources"]:
@@ -116,12 +127,23 @@ def rows(dbname, tablename):
         schema=schema,
         title=schema.get("title") or "Table {}".format(tablename),
         views=views,
-        rows=cursor,
+        rows=rows,
+        page=page,
         updateable=updateable,
         has_write_access=dbshare.db.has_write_access(db),
     )
 
 
+def get_display_page_args():
+    """Return the request arguments for the page of rows to display, as a dict
+    with 'after' and 'limit'. The limit is at most MAX_NROWS_DISPLAY.
+    Raise ValueError if invalid limit.
+    """
+    config = flask.current_app.config
+    after, limit = utils.get_page_args(limit=config["ROWS_DISPLAY_PAGE_SIZE"])
+    return {"after": after, "limit": min(limit, config["MAX_NROWS_DISPLAY"])}
+
+
 @blueprint.route(
     "/<name:dbname>/<name:tablename>/edit", methods=["GET", "POST", "DELETE"]
 )
@@ -653,7 +675,7 @@ def download_csv(dbname, tablename):
         utils.flash_error("no such table")
         return flask.redirect(flask.url_for("db.display", dbname=dbname))
     try:
-        delimiter = flask.request.form.get("delimiter") or "comma"
+        delimiter = flask.request.args.get("delimiter") or "comma"
         try:
             delimiter = flask.current_app.config["CSV_FILE_DELIMITERS"][delimiter][
                 "char"
@@ -667,19 +689,34 @@ def download_csv(dbname, tablename):
                 header.insert(0, "rowid")
         else:
             header = None
+        key = dbshare.exports.get_key(
+            db,
+            "csv",
+            source=tablename,
+            header=bool(header),
+            delimiter=delimiter,
+            rowid=rowid,
+        )
+        infile = dbshare.exports.get(key)
+        if infile is not None:
+            return dbshare.exports.send(
+                key, infile, constants.CSV_MIMETYPE, filename=f"{tablename}.csv"
+            )
         writer = utils.CsvWriter(header, delimiter=delimiter)
         colnames = ['"%(name)s"' % c for c in schema["columns"]]
         if rowid:
             colnames.insert(0, "rowid")
         dbcnx = dbshare.db.get_cnx(dbname)
         sql = 'SELECT %s FROM "%s"' % (",".join(colnames), tablename)
-        writer.write_rows(utils.execute_timeout(dbcnx, sql))
+        cursor = utils.execute_timeout(dbcnx, sql)
     except (ValueError, SystemError, sqlite3.Error) as error:
         utils.flash_error(error)
         return flask.redirect(
             flask.url_for(".download", dbname=dbname, tablename=tablename)
         )
-    response = flask.make_response(writer.getvalue())
+    rows = utils.iter_timeout(dbcnx, cursor)
+    chunks = dbshare.exports.store(key, writer.stream(rows))
+    response = flask.Response(flask.stream_with_context(chunks))
     response.headers.set("Content-Type", constants.CSV_MIMETYPE)
     response.headers.set(
         "Content-Disposition", "attachment", filename=f"{tablename}.csv"
@@ -4,6 +4,8 @@ import http.client
 import json
 import re
 import sqlite3
+import threading
+import time
 
 import flask
 import werkzeug.security
@@ -139,6 +141,7 @@ def edit(username):
             cnx.execute(sql, (username,))
             sql = "DELETE FROM users WHERE username=?"
             cnx.execute(sql, (username,))
+        user_cache.invalidate(username)
         utils.flash_message(f"Deleted user {username}.")
         return flask.redirect(flask.url_for(".users"))
 
@@ -281,7 +284,7 @@ class UserSaver:
             for key, value in self.user.items():
                 if value != self.orig.get(key):
                     new[key] = value
-            new.pop("modified")
+            new.pop("modified", None)
             try:
                 password = new["password"]
             except KeyError:
@@ -318,6 +321,8 @@ class UserSaver:
                     utils.get_time(),
                 ),
             )
+        # Any change, e.g. of status or API key, must take effect immediately.
+        user_cache.invalidate(self.user["username"])
 
     def set_username(self, username):
         if "username" in self.user:
@@ -414,13 +419,22 @@ def get_user(username=None, email=None, apikey=None):
 def get_current_user():
     """Return the user for the current session.
     Return None if no such user, or disabled.
+    The user is looked up in a cache, and only if not there in the database.
     """
-    user = get_user(
-        username=flask.session.get("username"),
-        apikey=flask.request.headers.get("x-apikey"),
-    )
-    if user is None:
+    username = flask.session.get("username")
+    apikey = flask.request.headers.get("x-apikey")
+    if username:
+        key = ("username", username)
+    elif apikey:
+        key = ("apikey", apikey)
+    else:
         return None
+    user = user_cache.get(key)
+    if user is None:
+        user = get_user(username=username, apikey=apikey)
+        if user is None:
+            return None
+        user_cache.put(key, user, flask.current_app.config["USER_CACHE_TTL"])
     if user["status"] == constants.ENABLED:
         return user
     else:
@@ -428,6 +442,80 @@ def get_current_user():
         return None
 
 
+class UserCache:
+    """Cache of the users for the current session, keyed by username or API key.
+    An entry expires after a time-to-live (TTL), which limits for how long
+    changes made by other processes may go unnoticed. Changes made in this
+    process invalidate the entries for the user.
+    """
+
+    def __init__(self, max_size=1024):
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        # (kind, value) -> (expires, user)
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def get(self, key):
+        "Return a copy of the user for the key, or None if not cached or expired."
+        now = time.monotonic()
+        with self.lock:
+            try:
+                expires, user = self.entries[key]
+            except KeyError:
+                self.misses += 1
+                return None
+            if now >= expires:
+                del self.entries[key]
+                self.misses += 1
+                return None
+            self.hits += 1
+        return dict(user)
+
+    def put(self, key, user, ttl):
+        "Store a copy of the user for the key, to expire after 'ttl' seconds."
+        if ttl <= 0:
+            return
+        now = time.monotonic()
+        with self.lock:
+            if len(self.entries) >= self.max_size:
+                self.entries = dict(
+                    [(k, e) for k, e in self.entries.items() if e[0] > now]
+                )
+                if len(self.entries) >= self.max_size:
+                    self.entries.clear()
+            self.entries[key] = (now + ttl, dict(user))
+
+    def invalidate(self, username):
+        "Remove all entries for the user."
+        with self.lock:
+            self.entries = dict(
+                [(k, e) for k, e in self.entries.items() if e[1]["username"] != username]
+            )
+            self.invalidations += 1
+
+    def get_stats(self):
+        "Return the current counts for the cache."
+        with self.lock:
+            return dict(
+                size=len(self.entries),
+                hits=self.hits,
+                misses=self.misses,
+                invalidations=self.invalidations,
+            )
+
+
+# The process-wide cache of users for 'get_current_user'.
+user_cache = UserCache()
+
+
+def get_user_cache_stats():
+    "Return the current counts for the user cache."
+    return user_cache.get_stats()
+
+
 def is_admin_or_self(user):
     "Is the current user admin, or the same as the given user?"
     if not flask.g.current_user:
@@ -446,8 +534,6 @@ def is_admin_and_not_self(user):
 
 def get_all_users():
     "Return a list of all users."
-    import dbshare.dbs
-
     sql = (
         "SELECT username, email, password, apikey,"
         " role, status, quota, created, modified FROM users"
@@ -457,7 +543,8 @@ def get_all_users():
         user["ndbs"] = 0
         user["size"] = 0
     lookup = dict([(u["username"], u) for u in users])
-    for db in dbshare.dbs.get_dbs():
-        lookup[db["owner"]]["ndbs"] += 1
-        lookup[db["owner"]]["size"] += db["size"]
+    sql = "SELECT owner, COUNT(*), SUM(size) FROM dbs GROUP BY owner"
+    for owner, ndbs, size in flask.g.syscnx.execute(sql):
+        lookup[owner]["ndbs"] = ndbs
+        lookup[owner]["size"] = size or 0
     return users
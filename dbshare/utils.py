@@ -1,5 +1,7 @@
 "Various utility functions and classes."
 
+import base64
+import bz2
 import csv
 import datetime
 import functools
@@ -10,10 +12,11 @@ import os.path
 import re
 import sqlite3
 import string
-import threading
+import tarfile
 import time
 import urllib.parse
 import uuid
+import zlib
 
 import flask
 import jinja2.utils
@@ -22,6 +25,7 @@ import markupsafe
 import werkzeug.routing
 
 import dbshare.lexer
+import dbshare.pool
 from dbshare import constants
 
 
@@ -128,24 +132,108 @@ class Timer:
         return round(1000 * self())
 
 
-def get_cnx(dbname=None, write=False):
-    """Return a new connection to the database by the given name.
+def get_cnx(dbname=None, write=False, immutable=False, profile=None):
+    """Return a connection to the database by the given name.
     If 'dbname' is None, return a connection to the system database.
-    If the database file does not exist, it will be created.
+    If the database file does not exist, it will be created in 'write' mode.
+    If 'immutable' is True, the database is in read-only mode, so its file
+    cannot change; open it without locking, and memory-map it.
+    The PRAGMAs of the named profile, or else the default profile,
+    are applied when a connection to a user database is opened.
+    The system database keeps the Sqlite3 defaults, with a rollback journal.
     The OS-level file permissions are set in DbSaver.
+    The connection is checked out from the process-wide pool, and
+    is returned to it when the app context is torn down.
     """
+    config = flask.current_app.config
+    if write:
+        mode = "write"
+    elif immutable:
+        mode = "immutable"
+    else:
+        mode = "read"
     if dbname is None:
         dbname = constants.SYSTEM
+        pragmas = {}
+    else:
+        try:
+            pragmas = config["PRAGMA_PROFILES"][profile]
+        except KeyError:
+            pragmas = config["PRAGMA_PROFILES"][config["PRAGMA_PROFILE"]]
+        pragmas = dict(pragmas)
+    if mode != "write":
+        pragmas.pop("journal_mode", None)
+    if mode == "immutable":
+        pragmas["mmap_size"] = int(config["IMMUTABLE_MMAP_SIZE"])
     dbpath = get_dbpath(dbname)
-    if write:
-        cnx = sqlite3.connect(dbpath)
+    connect = functools.partial(_connect, dbpath, mode, pragmas)
+    try:
+        stat = os.stat(dbpath)
+        identity = (stat.st_dev, stat.st_ino, stat.st_mode)
+    except FileNotFoundError:
+        identity = None
+    cnx = dbshare.pool.acquire((dbname, mode), connect, identity=identity)
+    flask.g.setdefault("pooled_cnxs", []).append(cnx)
+    return cnx
+
+
+def _connect(dbpath, mode, pragmas):
+    """Open a new connection to the database file; used by the pool.
+    Pooled connections are used by different threads, but never concurrently.
+    """
+    if mode == "write":
+        cnx = sqlite3.connect(dbpath, check_same_thread=False)
     else:
-        path = f"file:{dbpath}?mode=ro"
-        cnx = sqlite3.connect(dbpath, uri=True)
+        uri = f"file:{urllib.parse.quote(dbpath)}?mode=ro"
+        if mode == "immutable":
+            uri += "&immutable=1"
+        cnx = sqlite3.connect(uri, uri=True, check_same_thread=False)
+    for name, value in pragmas.items():
+        if name == "journal_mode":
+            set_journal_mode(cnx, value)
+        else:
+            cnx.execute(f"PRAGMA {name}={value}")
     cnx.row_factory = sqlite3.Row
     return cnx
 
 
+def set_journal_mode(cnx, journal_mode, wait=False):
+    """Set the journal mode of the database, if not already set.
+    This requires that no other connection is using the database.
+    Unless 'wait' is True, give up at once if so; it will be retried
+    by the next write connection.
+    Return the resulting journal mode.
+    """
+    current = cnx.execute("PRAGMA journal_mode").fetchone()[0]
+    if current.upper() == journal_mode.upper():
+        return current
+    if not wait:
+        timeout = cnx.execute("PRAGMA busy_timeout").fetchone()[0]
+        cnx.execute("PRAGMA busy_timeout=0")
+    try:
+        current = cnx.execute(f"PRAGMA journal_mode={journal_mode}").fetchone()[0]
+    except sqlite3.OperationalError:  # Database is locked.
+        pass
+    if not wait:
+        cnx.execute(f"PRAGMA busy_timeout={timeout}")
+    return current
+
+
+def release_cnx(cnx):
+    "Return the connection to the pool before the app context is torn down."
+    try:
+        flask.g.pooled_cnxs.remove(cnx)
+    except (AttributeError, ValueError):
+        return
+    dbshare.pool.release(cnx)
+
+
+def release_cnxs():
+    "Return all connections checked out in this app context to the pool."
+    for cnx in flask.g.pop("pooled_cnxs", []):
+        dbshare.pool.release(cnx)
+
+
 def get_dbpath(dbname):
     "Return the full file path of the database given by name."
     return os.path.join(flask.current_app.config["DATABASES_DIR"], f"{dbname}.sqlite3")
@@ -261,6 +349,59 @@ def get_json(**items):
     return result
 
 
+def accept_ndjson():
+    "Return True if the header Accept prefers the newline-delimited JSON type."
+    acc = flask.request.accept_mimetypes
+    best = acc.best_match([constants.JSON_MIMETYPE, constants.NDJSON_MIMETYPE])
+    return best == constants.NDJSON_MIMETYPE
+
+
+def stream_json_rows(result, columns, rows, ndjson=False, chunk_size=None):
+    """Yield UTF-8 encoded chunks of about 'chunk_size' characters,
+    by default STREAM_CHUNK_SIZE, of the JSON for the result dictionary
+    with an item 'data' added last, which is the list of the rows as
+    dictionaries with the given columns as keys. The rows are encoded
+    one at a time, so the data is never all in memory.
+    If 'ndjson' is True, then output only the rows as newline-delimited JSON.
+    """
+    if chunk_size is None:
+        chunk_size = flask.current_app.config["STREAM_CHUNK_SIZE"]
+    encode = json.JSONEncoder(
+        ensure_ascii=flask.current_app.json.ensure_ascii,
+        sort_keys=flask.current_app.json.sort_keys,
+        default=flask.current_app.json.default,
+    ).encode
+    if ndjson:
+        separator = "\n"
+        buffer = []
+    else:
+        separator = ","
+        head = encode(result)[:-1]
+        if head != "{":
+            head += ","
+        buffer = [head + '"data":[']
+    size = len(buffer and buffer[0] or "")
+    first = True
+    for row in rows:
+        if first:
+            first = False
+        else:
+            buffer.append(separator)
+        item = encode(dict(zip(columns, row)))
+        buffer.append(item)
+        size += len(item)
+        if size >= chunk_size:
+            yield "".join(buffer).encode("utf-8")
+            buffer = []
+            size = 0
+    if ndjson:
+        if not first:
+            buffer.append("\n")
+    else:
+        buffer.append("]}")
+    yield "".join(buffer).encode("utf-8")
+
+
 def http_GET():
     "Is the HTTP method GET?"
     return flask.request.method == "GET"
@@ -436,42 +577,46 @@ def abort_json(status_code, error):
     flask.abort(response)
 
 
-def _timeout_interrupt(cnx, event, timeout, increment, backoff):
-    "Background thread to interrupt the Sqlite3 query when timeout."
-    assert timeout > 0.0
-    assert increment > 0.0
-    assert backoff > 1.0
-    event.wait()
-    elapsed = 0.0
-    while elapsed < timeout:
-        if not event.is_set():
-            return
-        time.sleep(increment)
-        elapsed += increment
-        increment *= backoff
-    cnx.interrupt()
-
-
-def execute_timeout(cnx, command, **kwargs):
+def get_execute_timeout():
+    """Return the time-out (in seconds) for query execution for the current user.
+    A per-user setting takes precedence over a per-role setting,
+    which in turn takes precedence over the default.
+    """
+    config = flask.current_app.config
+    user = flask.g.get("current_user")
+    if user:
+        try:
+            return config["EXECUTE_TIMEOUT_USERS"][user["username"]]
+        except KeyError:
+            pass
+        try:
+            return config["EXECUTE_TIMEOUT_ROLES"][user["role"]]
+        except KeyError:
+            pass
+    return config["EXECUTE_TIMEOUT"]
+
+
+def execute_timeout(cnx, command, timeout=None, **kwargs):
     """Perform Sqlite3 command to be interrupted if running too long.
     If the given command is a string, it is executed as SQL.
     If the command is a callable, call it with the cnx and any given
     keyword arguments.
+    The timeout is in seconds, by default the query execution time-out
+    for the current user. The deadline is checked by a progress handler
+    every EXECUTE_TIMEOUT_INSTRUCTIONS Sqlite3 virtual machine instructions.
     Raises SystemError if interrupted by timeout.
     """
-    config = flask.current_app.config
-    event = threading.Event()
-    timeout = config["EXECUTE_TIMEOUT"]
-    args = (
-        cnx,
-        event,
-        timeout,
-        config["EXECUTE_TIMEOUT_INCREMENT"],
-        config["EXECUTE_TIMEOUT_BACKOFF"],
+    if timeout is None:
+        timeout = get_execute_timeout()
+    deadline = time.monotonic() + timeout
+
+    def handler():
+        "A true value returned aborts the Sqlite3 operation."
+        return time.monotonic() > deadline
+
+    cnx.set_progress_handler(
+        handler, flask.current_app.config["EXECUTE_TIMEOUT_INSTRUCTIONS"]
     )
-    thread = threading.Thread(target=_timeout_interrupt, args=args)
-    thread.start()
-    event.set()
     try:
         if isinstance(command, str):  # SQL
             result = cnx.execute(command)
@@ -488,11 +633,180 @@ def execute_timeout(cnx, command, **kwargs):
             raise SystemError(f"execution exceeded {timeout} seconds; interrupted")
         else:
             raise
-    event.clear()
-    thread.join()
+    finally:
+        cnx.set_progress_handler(None, 0)
     return result
 
 
+def iter_timeout(cnx, cursor, timeout=None):
+    """Yield the rows from the cursor of the given connection,
+    to be interrupted if running too long. Intended for streamed output,
+    which may run longer than the query; the timeout is in seconds,
+    by default STREAM_TIMEOUT. The deadline is checked by a progress handler
+    while Sqlite3 produces the rows, and also between batches of rows,
+    since a slow client may hold up the stream.
+    Raises SystemError if interrupted by timeout.
+    """
+    config = flask.current_app.config
+    if timeout is None:
+        timeout = config["STREAM_TIMEOUT"]
+    deadline = time.monotonic() + timeout
+
+    def handler():
+        "A true value returned aborts the Sqlite3 operation."
+        return time.monotonic() > deadline
+
+    cnx.set_progress_handler(handler, config["EXECUTE_TIMEOUT_INSTRUCTIONS"])
+    try:
+        while True:
+            rows = cursor.fetchmany(config["STREAM_BATCH_SIZE"])
+            if not rows:
+                break
+            yield from rows
+            if time.monotonic() > deadline:
+                raise SystemError(f"output exceeded {timeout} seconds; interrupted")
+    except sqlite3.OperationalError as error:
+        if str(error) == "interrupted":
+            raise SystemError(f"output exceeded {timeout} seconds; interrupted")
+        else:
+            raise
+    finally:
+        cnx.set_progress_handler(None, 0)
+
+
+def get_page_args(limit=None):
+    """Return the keyset pagination request arguments (after, limit).
+    Return None if neither is given, unless a default 'limit' is given.
+    Otherwise the default limit is ROWS_PAGE_SIZE.
+    Raise ValueError if invalid limit.
+    """
+    after = flask.request.args.get("after") or None
+    if flask.request.args.get("limit"):
+        limit = flask.request.args["limit"]
+    elif after is None and limit is None:
+        return None
+    try:
+        limit = int(limit or flask.current_app.config["ROWS_PAGE_SIZE"])
+        if limit <= 0:
+            raise ValueError
+    except ValueError:
+        raise ValueError("invalid limit")
+    return (after, limit)
+
+
+def get_rows_page(cnx, sourcename, columns, limit, after=None, keys=None):
+    """Return a page of at most 'limit' rows with the given columns from
+    the table or view, following the position given by the cursor 'after',
+    and the cursor for the next page, or None if there are no more rows.
+    If 'keys' is None, the rows are ordered by rowid, and the cursor is the
+    rowid of the last row. Otherwise the rows are ordered by the given key
+    columns, and the cursor encodes the key values of the last row, and the
+    number of rows with those values that have already been returned.
+    The cost of a page does not depend on how deep into the rows it is.
+    Raise ValueError if invalid cursor.
+    Raise SystemError if interrupted by time-out.
+    """
+    colnames = ",".join([f'"{c}"' for c in columns])
+    if keys is None:
+        sql = f'SELECT rowid, {colnames} FROM "{sourcename}"'
+        values = []
+        if after is not None:
+            try:
+                values.append(int(after))
+            except ValueError:
+                raise ValueError("invalid cursor")
+            sql += " WHERE rowid>?"
+        sql += " ORDER BY rowid LIMIT ?"
+        values.append(limit + 1)
+        rows = execute_timeout(cnx, _fetchall, sql=sql, values=values)
+        if len(rows) > limit:
+            rows = rows[:limit]
+            after = str(rows[-1][0])
+        else:
+            after = None
+        return [row[1:] for row in rows], after
+
+    # Ordered by the key columns; may contain duplicates and NULLs.
+    positions = [columns.index(k) for k in keys]
+    order = ",".join([f'"{k}"' for k in keys])
+    sql = f'SELECT {colnames} FROM "{sourcename}"'
+    values = []
+    skip = 0
+    if after is not None:
+        last, skip = _decode_cursor(after, len(keys))
+        expression, values = _get_sql_keyset(keys, last)
+        sql += f" WHERE {expression}"
+    sql += f" ORDER BY {order} LIMIT ?"
+    values.append(skip + limit + 1)
+    rows = execute_timeout(cnx, _fetchall, sql=sql, values=values)[skip:]
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    key = [rows[-1][p] for p in positions]
+    count = 0
+    for row in reversed(rows):
+        if [row[p] for p in positions] != key:
+            break
+        count += 1
+    # All rows of the page have the same key values as the previous page.
+    if count == limit and after is not None and key == last:
+        count += skip
+    return rows, _encode_cursor(key, count)
+
+
+def _fetchall(cnx, sql, values):
+    "Execute the SQL and fetch all rows; executed with time-out."
+    return cnx.execute(sql, values).fetchall()
+
+
+def _get_sql_keyset(keys, last):
+    """Return the SQL expression and its values for the rows positioned
+    at or after the given values of the key columns, in SQL ordering.
+    NULL sorts first, so nothing is less than it.
+    """
+    expression = "1"
+    values = []
+    for key, value in reversed(list(zip(keys, last))):
+        if value is None:
+            expression = f'("{key}" IS NOT NULL OR ("{key}" IS NULL AND {expression}))'
+        else:
+            expression = f'("{key}">? OR ("{key}" IS ? AND {expression}))'
+            values = [value, value] + values
+    # Help the query planner to use an index on the first key column.
+    if last[0] is not None:
+        expression = f'"{keys[0]}">=? AND {expression}'
+        values.insert(0, last[0])
+    return expression, values
+
+
+def _encode_cursor(key, count):
+    "Return the cursor string for the key values and the count of rows."
+    data = json.dumps([key, count], default=lambda b: {"$blob": b.hex()})
+    return base64.urlsafe_b64encode(data.encode("utf-8")).decode("ascii")
+
+
+def _decode_cursor(after, nkeys):
+    """Return the key values and the count of rows from the cursor string.
+    Raise ValueError if invalid, or if the key values are not as many as
+    the key columns, or not all of them are Sqlite3 scalar values.
+    """
+    try:
+        key, count = json.loads(
+            base64.urlsafe_b64decode(after.encode("ascii")),
+            object_hook=lambda d: bytes.fromhex(d["$blob"]),
+        )
+        if not isinstance(key, list) or len(key) != nkeys:
+            raise ValueError
+        for value in key:
+            if value is not None and type(value) not in (int, float, str, bytes):
+                raise ValueError
+        if type(count) is not int or count < 0:
+            raise ValueError
+    except (ValueError, TypeError, KeyError):
+        raise ValueError("invalid cursor")
+    return key, count
+
+
 class CsvWriter:
     "Create CSV file content from rows of data."
 
@@ -511,3 +825,79 @@ class CsvWriter:
     def getvalue(self):
         "Return the written data."
         return self.outfile.getvalue()
+
+    def stream(self, rows, chunk_size=None):
+        """Yield the data written so far followed by the given rows,
+        as UTF-8 encoded chunks of about 'chunk_size' characters,
+        by default STREAM_CHUNK_SIZE. The data is not retained.
+        """
+        if chunk_size is None:
+            chunk_size = flask.current_app.config["STREAM_CHUNK_SIZE"]
+        for row in rows:
+            self.writer.writerow(row)
+            if self.outfile.tell() >= chunk_size:
+                yield self.flush()
+        chunk = self.flush()
+        if chunk:
+            yield chunk
+
+    def flush(self):
+        "Return the data written so far as UTF-8 encoded bytes, and discard it."
+        result = self.outfile.getvalue().encode("utf-8")
+        self.outfile.seek(0)
+        self.outfile.truncate()
+        return result
+
+
+class TarWriter:
+    """Create tar file content, optionally compressed by 'gz' or 'bz2',
+    as a stream of chunks. The size of each member must be known beforehand.
+    """
+
+    def __init__(self, compression=None):
+        if compression == "gz":
+            self.compressor = zlib.compressobj(wbits=31)  # With gzip header.
+        elif compression == "bz2":
+            self.compressor = bz2.BZ2Compressor()
+        elif compression is None:
+            self.compressor = None
+        else:
+            raise ValueError(f"invalid tar compression '{compression}'")
+        self.offset = 0
+
+    def add(self, name, infile, size, chunk_size=None):
+        """Yield the chunks of the member with the given name, having the
+        contents of size 'size' bytes read from the given open file.
+        """
+        if chunk_size is None:
+            chunk_size = flask.current_app.config["STREAM_CHUNK_SIZE"]
+        tarinfo = tarfile.TarInfo(name=name)
+        tarinfo.size = size
+        tarinfo.mtime = int(time.time())
+        yield self.write(tarinfo.tobuf())
+        while True:
+            data = infile.read(chunk_size)
+            if not data:
+                break
+            yield self.write(data)
+        remainder = size % tarfile.BLOCKSIZE
+        if remainder:
+            yield self.write(tarfile.NUL * (tarfile.BLOCKSIZE - remainder))
+
+    def close(self):
+        "Yield the chunks ending the archive."
+        # Two empty blocks, then padding to a whole record, as 'tarfile' does.
+        data = tarfile.NUL * (2 * tarfile.BLOCKSIZE)
+        remainder = (self.offset + len(data)) % tarfile.RECORDSIZE
+        if remainder:
+            data += tarfile.NUL * (tarfile.RECORDSIZE - remainder)
+        yield self.write(data)
+        if self.compressor is not None:
+            yield self.compressor.flush()
+
+    def write(self, data):
+        "Return the given data, compressed if so specified."
+        self.offset += len(data)
+        if self.compressor is None:
+            return data
+        return self.compressor.compress(data)
@@ -7,6 +7,7 @@ import sqlite3
 import flask
 
 import dbshare.db
+import dbshare.exports
 import dbshare.table
 
 from dbshare import constants
@@ -127,30 +128,32 @@ def rows(dbname, viewname):
         utils.flash_error("no such view")
         return flask.redirect(flask.url_for("db.display", dbname=dbname))
     try:
-        dbcnx = dbshare.db.get_cnx(dbname)
-        columns = [c["name"] for c in schema["columns"]]
-        quoted_columns = [f'"{c}"' for c in columns]
-        sql = 'SELECT %s FROM "%s"' % (",".join(quoted_columns), viewname)
-        limit = flask.current_app.config["MAX_NROWS_DISPLAY"]
-        if schema["nrows"] is None:
-            utils.flash_error("too many rows to fetch; interrupted")
-            cursor = []  # Fake cursor
-        elif schema["nrows"] > limit:
-            utils.flash_message_limit(limit)
-            sql += f" LIMIT {limit}"
-            cursor = utils.execute_timeout(dbcnx, sql)  # Maybe LIMIT
-        else:
-            cursor = utils.execute_timeout(dbcnx, sql)
+        page = dbshare.table.get_display_page_args()
+        rows, after = utils.get_rows_page(
+            dbshare.db.get_cnx(dbname),
+            viewname,
+            [c["name"] for c in schema["columns"]],
+            page["limit"],
+            after=page["after"],
+            keys=dbshare.db.get_row_keys(db, schema),
+        )
+    except ValueError as error:
+        utils.flash_error(error)
+        return flask.redirect(flask.url_for(".rows", dbname=dbname, viewname=viewname))
     except (SystemError, sqlite3.Error) as error:
         utils.flash_error(error)
-        return flask.redirect(flask.url_for(".schema", viewname=str(viewname)))
+        return flask.redirect(
+            flask.url_for(".schema", dbname=dbname, viewname=viewname)
+        )
+    page["next"] = after
     return flask.render_template(
         "view/rows.html",
         db=db,
         schema=schema,
         query=schema["query"],
         title=schema.get("title") or "View {}".format(viewname),
-        rows=cursor,
+        rows=rows,
+        page=page,
         has_write_access=dbshare.db.has_write_access(db),
     )
 
@@ -240,7 +243,7 @@ def download_csv(dbname, viewname):
         utils.flash_error("no such view")
         return flask.redirect(flask.url_for("db.display", dbname=dbname))
     try:
-        delimiter = flask.request.form.get("delimiter") or "comma"
+        delimiter = flask.request.args.get("delimiter") or "comma"
         try:
             delimiter = flask.current_app.config["CSV_FILE_DELIMITERS"][delimiter][
                 "char"
@@ -248,20 +251,30 @@ def download_csv(dbname, viewname):
         except KeyError:
             raise ValueError("invalid delimiter")
         if utils.to_bool(flask.request.args.get("header")):
-            header = schema["query"]["columns"]
+            header = [c["name"] for c in schema["columns"]]
         else:
             header = None
+        key = dbshare.exports.get_key(
+            db, "csv", source=viewname, header=bool(header), delimiter=delimiter
+        )
+        infile = dbshare.exports.get(key)
+        if infile is not None:
+            return dbshare.exports.send(
+                key, infile, constants.CSV_MIMETYPE, filename=f"{viewname}.csv"
+            )
         writer = utils.CsvWriter(header, delimiter=delimiter)
         dbcnx = dbshare.db.get_cnx(dbname)
-        colnames = ['"%s"' % c for c in schema["query"]["columns"]]
+        colnames = ['"%(name)s"' % c for c in schema["columns"]]
         sql = 'SELECT %s FROM "%s"' % (",".join(colnames), viewname)
-        writer.write_rows(utils.execute_timeout(dbcnx, sql))
+        cursor = utils.execute_timeout(dbcnx, sql)
     except (ValueError, SystemError, sqlite3.Error) as error:
         utils.flash_error(error)
         return flask.redirect(
             flask.url_for(".download", dbname=dbname, viewname=viewname)
         )
-    response = flask.make_response(writer.getvalue())
+    rows = utils.iter_timeout(dbcnx, cursor)
+    chunks = dbshare.exports.store(key, writer.stream(rows))
+    response = flask.Response(flask.stream_with_context(chunks))
     response.headers.set("Content-Type", constants.CSV_MIMETYPE)
     response.headers.set(
         "Content-Disposition", "attachment", filename="%s.csv" % viewname
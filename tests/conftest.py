@@ -0,0 +1,64 @@
+"""Fixtures for the tests that use the Flask app directly,
+with the databases in a temporary directory.
+"""
+
+import json
+import os
+
+import flask
+import pytest
+
+
+@pytest.fixture(scope="session")
+def app(tmp_path_factory):
+    "Set up the app with a temporary databases directory and a user."
+    dirpath = tmp_path_factory.mktemp("dbshare")
+    settingspath = dirpath / "settings.json"
+    with open(settingspath, "w") as outfile:
+        json.dump({"SECRET_KEY": "test", "DATABASES_DIR": str(dirpath)}, outfile)
+    os.environ["SETTINGS_FILEPATH"] = str(settingspath)
+    import dbshare.main
+    import dbshare.user
+    from dbshare import constants
+    from dbshare import utils
+
+    app = dbshare.main.app
+    with app.app_context():
+        flask.g.syscnx = utils.get_cnx()
+        with dbshare.user.UserSaver() as saver:
+            saver.set_username("tester")
+            saver.set_email("tester@example.com")
+            saver.set_password("password")
+            saver.set_role(constants.USER)
+            saver.set_status(constants.ENABLED)
+            saver.set_apikey()
+    yield app
+
+
+@pytest.fixture()
+def saver(app):
+    "Yield a saver for a new database; delete it afterwards."
+    import dbshare.db
+    import dbshare.user
+    from dbshare import utils
+
+    with app.test_request_context():
+        flask.g.syscnx = utils.get_cnx()
+        flask.g.current_user = dbshare.user.get_user(username="tester")
+        with dbshare.db.DbSaver() as saver:
+            saver.set_name("test")
+            saver.initialize()
+        with dbshare.db.DbSaver(dbshare.db.get_db("test", complete=True)) as saver:
+            yield saver
+        dbshare.db.delete_database("test")
+
+
+@pytest.fixture()
+def apikey(app):
+    "Return the API key of the user."
+    import dbshare.user
+    from dbshare import utils
+
+    with app.app_context():
+        flask.g.syscnx = utils.get_cnx()
+        return dbshare.user.get_user(username="tester")["apikey"]
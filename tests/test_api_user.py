@@ -3,9 +3,11 @@
 Uses the 'requests' package.
 """
 
+import base64
 import csv
 import http.client
 import io
+import json
 
 import requests
 import pytest
@@ -114,6 +116,36 @@ def test_upload_database(settings, database):
     response = session.put(url, data="garbage", headers=headers)
     assert response.status_code == http.client.UNSUPPORTED_MEDIA_TYPE
 
+    # Attempt upload of a file that is not an Sqlite3 database.
+    headers = {"Content-Type": "application/x-sqlite3"}
+    response = session.put(url, data="garbage" * 1000, headers=headers)
+    assert response.status_code == http.client.BAD_REQUEST
+    response = session.get(url)
+    assert response.status_code == http.client.NOT_FOUND
+
+
+def test_upload_xlsx(settings, database):
+    "Test uploading an XLSX file, as downloaded from a database."
+    session = settings["session"]
+    response = session.get(f"{settings['BASE_URL']}/db/test.xlsx")
+    assert response.status_code == http.client.OK
+
+    url = f"{settings['BASE_URL']}/api/db/test_xlsx"
+    headers = {
+        "Content-Type": "application/vnd.openxmlformats-officedocument"
+        ".spreadsheetml.sheet"
+    }
+    response = session.put(url, data=response.content, headers=headers)
+    assert response.status_code == http.client.OK
+    data = response.json()
+    assert len(data["tables"]) == 1
+    table = data["tables"][0]
+    assert table["name"] == "t1"
+    assert table["nrows"] == 3
+
+    # Delete the database.
+    session.delete(url)
+
 
 def test_table(settings, database):
     "Test creating, modifying and deleting a table."
@@ -267,6 +299,135 @@ def test_csv(settings, database):
     assert data["nrows"] == 6
 
 
+def test_rows_ndjson(settings, database):
+    "Test getting the rows of a table as newline-delimited JSON."
+    session = settings["session"]
+
+    url = f"{settings['BASE_URL']}/api/table/test/t1.json"
+    response = session.get(url, headers={"Accept": "application/x-ndjson"})
+    assert response.status_code == http.client.OK
+    assert response.headers["Content-Type"].startswith("application/x-ndjson")
+    lines = response.text.splitlines()
+    assert len(lines) == 3
+    assert json.loads(lines[0])["i"] == 1
+
+    # The default is ordinary JSON.
+    response = session.get(url)
+    assert response.status_code == http.client.OK
+    assert len(response.json()["data"]) == 3
+
+
+def test_rows_paging(settings, database):
+    "Test paging through the rows of a table."
+    session = settings["session"]
+
+    url = f"{settings['BASE_URL']}/api/table/test/t1.json"
+    response = session.get(url, params={"limit": 2})
+    assert response.status_code == http.client.OK
+    data = response.json()
+    assert [row["i"] for row in data["data"]] == [1, 2]
+    assert data["next"]["href"] == response.links["next"]["url"]
+
+    response = session.get(data["next"]["href"])
+    assert response.status_code == http.client.OK
+    data = response.json()
+    assert [row["i"] for row in data["data"]] == [3]
+    assert data["next"] is None
+    assert "next" not in response.links
+
+    # Same for CSV.
+    url = f"{settings['BASE_URL']}/api/table/test/t1.csv"
+    response = session.get(url, params={"limit": 2})
+    assert response.status_code == http.client.OK
+    assert len(list(csv.reader(io.StringIO(response.text)))) == 3
+    response = session.get(response.links["next"]["url"])
+    assert len(list(csv.reader(io.StringIO(response.text)))) == 2
+
+    response = session.get(url, params={"limit": 0})
+    assert response.status_code == http.client.BAD_REQUEST
+
+
+def test_rows_columnar(settings, database):
+    "Test getting the rows of a table in Parquet and Arrow IPC formats."
+    session = settings["session"]
+
+    # Not acceptable if the server lacks the optional package.
+    url = f"{settings['BASE_URL']}/api/table/test/t1.parquet"
+    response = session.get(url)
+    assert response.status_code in (http.client.OK, http.client.NOT_ACCEPTABLE)
+    if response.status_code == http.client.OK:
+        assert response.content[:4] == b"PAR1"
+        assert response.content[-4:] == b"PAR1"
+
+    url = f"{settings['BASE_URL']}/api/table/test/t1.arrow"
+    response = session.get(url)
+    assert response.status_code in (http.client.OK, http.client.NOT_ACCEPTABLE)
+    if response.status_code == http.client.OK:
+        assert response.content[:6] == b"ARROW1"
+
+
+def test_rows_not_modified(settings, database):
+    "Test conditional requests for the rows of a table."
+    session = settings["session"]
+
+    url = f"{settings['BASE_URL']}/api/table/test/t1.json"
+    response = session.get(url)
+    assert response.status_code == http.client.OK
+    etag = response.headers["ETag"]
+    assert response.headers["Last-Modified"]
+
+    response = session.get(url, headers={"If-None-Match": etag})
+    assert response.status_code == http.client.NOT_MODIFIED
+    assert not response.content
+
+    # Modifying the table changes the ETag.
+    row = {"data": [{"i": 4, "r1": 1.02, "i1": 3091, "t1": "blopp"}]}
+    response = session.post(
+        f"{settings['BASE_URL']}/api/table/test/t1/insert", json=row
+    )
+    assert response.status_code == http.client.OK
+    response = session.get(url, headers={"If-None-Match": etag})
+    assert response.status_code == http.client.OK
+    assert response.headers["ETag"] != etag
+
+
+def test_rows_compressed(settings, database):
+    "Test compression of the rows of a table according to Accept-Encoding."
+    session = settings["session"]
+
+    # Add rows to make the output large enough to be compressed.
+    rows = {
+        "data": [
+            {"i": i, "r1": i / 3, "i1": i, "t1": f"row number {i}"}
+            for i in range(10, 210)
+        ]
+    }
+    response = session.post(
+        f"{settings['BASE_URL']}/api/table/test/t1/insert", json=rows
+    )
+    assert response.status_code == http.client.OK
+
+    url = f"{settings['BASE_URL']}/api/table/test/t1.csv"
+    response = session.get(url, headers={"Accept-Encoding": "gzip"})
+    assert response.status_code == http.client.OK
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert "Accept-Encoding" in response.headers["Vary"]
+    # The 'requests' package decompresses the content.
+    assert len(list(csv.reader(io.StringIO(response.text)))) == 204
+
+    response = session.get(url, headers={"Accept-Encoding": "identity"})
+    assert response.status_code == http.client.OK
+    assert "Content-Encoding" not in response.headers
+    assert len(list(csv.reader(io.StringIO(response.text)))) == 204
+
+    # Small output is not compressed.
+    response = session.get(
+        url, params={"limit": 1}, headers={"Accept-Encoding": "gzip"}
+    )
+    assert response.status_code == http.client.OK
+    assert "Content-Encoding" not in response.headers
+
+
 def test_index(settings, database):
     "Test index for a table."
     session = settings["session"]
@@ -421,6 +582,40 @@ def test_view(settings, database):
     assert response.status_code == http.client.NO_CONTENT
 
 
+def test_view_paging_cursor(settings, database):
+    "Test paging through the rows of a view, and an invalid cursor."
+    session = settings["session"]
+
+    view_spec = {"name": "v1", "query": {"from": "t1", "select": "r1, i1"}}
+    response = session.put(f"{settings['BASE_URL']}/api/view/test/v1", json=view_spec)
+    assert response.status_code == http.client.OK
+
+    url = f"{settings['BASE_URL']}/api/view/test/v1.json"
+    response = session.get(url, params={"limit": 2})
+    assert response.status_code == http.client.OK
+    next_url = response.json()["next"]["href"]
+    response = session.get(next_url)
+    assert response.status_code == http.client.OK
+    assert len(response.json()["data"]) == 1
+
+    # The cursor encodes the values of the key columns and a count.
+    for key, count in [
+        ([[1], {}], 0),  # Not scalar values.
+        ([1], 0),  # Not as many values as key columns.
+        ("ab", 0),  # Not a list.
+        ([1, 2], -1),  # Invalid count.
+    ]:
+        cursor = json.dumps([key, count]).encode("utf-8")
+        cursor = base64.urlsafe_b64encode(cursor).decode("ascii")
+        response = session.get(url, params={"limit": 2, "after": cursor})
+        assert response.status_code == http.client.BAD_REQUEST
+    response = session.get(url, params={"limit": 2, "after": "x"})
+    assert response.status_code == http.client.BAD_REQUEST
+
+    response = session.delete(f"{settings['BASE_URL']}/api/view/test/v1")
+    assert response.status_code == http.client.NO_CONTENT
+
+
 def test_user(settings):
     "Test access to the user account."
     session = settings["session"]
@@ -0,0 +1,31 @@
+"""Test the server-side processing endpoint for the DataTables grid.
+
+Uses the Flask app directly, with the databases in a temporary directory.
+"""
+
+
+def test_datatables_blob(app, saver, apikey):
+    "Test that a BLOB value is returned as text, as in the HTML page."
+    schema = {
+        "name": "t1",
+        "columns": [
+            {"name": "i", "type": "INTEGER"},
+            {"name": "b", "type": "BLOB"},
+        ],
+    }
+    saver.add_table(schema)
+    with saver.dbcnx:
+        saver.dbcnx.execute("INSERT INTO t1 (i, b) VALUES (1, ?)", (b"\x00ab",))
+        saver.dbcnx.execute("INSERT INTO t1 (i, b) VALUES (2, NULL)")
+    saver.update_table(schema)
+    response = app.test_client().get(
+        "/data/test/t1/datatables",
+        query_string={"draw": "1", "start": "0", "length": "10"},
+        headers={"x-apikey": apikey},
+    )
+    assert response.status_code == 200
+    data = response.get_json()
+    assert data["draw"] == 1
+    assert data["recordsTotal"] == 2
+    # The rowid is appended to each row.
+    assert data["data"] == [[1, str(b"\x00ab"), 1], [2, None, 2]]
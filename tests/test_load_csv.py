@@ -0,0 +1,72 @@
+"""Test loading CSV files into tables.
+
+Uses the Flask app directly, with the databases in a temporary directory.
+"""
+
+import csv
+
+import pytest
+
+
+@pytest.fixture()
+def csvfile(tmp_path):
+    """Write a CSV file where a column looks numeric in the first part
+    and has a non-numeric value near the end, and a column is INTEGER
+    in the first part and REAL near the end.
+    """
+    filepath = tmp_path / "data.csv"
+    with open(filepath, "w", newline="") as outfile:
+        writer = csv.writer(outfile)
+        writer.writerow(["code", "number", "text"])
+        for n in range(1000):
+            code = ["007", "1.50", " 5", "1_000"][n % 4]
+            if n == 990:
+                code = "A1"
+            number = 0.5 if n == 995 else n
+            writer.writerow([code, number, f"line\n{n}" if n % 10 == 0 else "x"])
+    return str(filepath)
+
+
+def get_table(saver, tablename):
+    "Return the types of the columns and the rows of the table."
+    columns = saver.db["tables"][tablename]["columns"]
+    rows = saver.dbcnx.execute(f'SELECT * FROM "{tablename}" ORDER BY rowid')
+    return [c["type"] for c in columns], [tuple(r) for r in rows]
+
+
+def test_load_csv_late_text(app, saver, csvfile, monkeypatch):
+    "Test that a column widened to TEXT late keeps the original values."
+    monkeypatch.setitem(app.config, "IMPORT_SAMPLE_SIZE", 100)
+    monkeypatch.setitem(app.config, "IMPORT_BATCH_SIZE", 100)
+    count = saver.create_table_load_csv("t1", csvfile, ",")
+    assert count == 1000
+    types, rows = get_table(saver, "t1")
+    assert types == ["TEXT", "REAL", "TEXT"]
+    assert [r[0] for r in rows[:4]] == ["007", "1.50", " 5", "1_000"]
+    assert rows[990][0] == "A1"
+    assert rows[10] == (" 5", 10.0, "line\n10")
+
+
+def test_load_csv_parallel(app, saver, csvfile, monkeypatch):
+    "Test loading a CSV file in parallel processes."
+    import dbshare.db
+
+    monkeypatch.setitem(app.config, "IMPORT_SAMPLE_SIZE", 100)
+    monkeypatch.setitem(app.config, "IMPORT_BATCH_SIZE", 100)
+    count = saver.create_table_load_csv("serial", csvfile, ",")
+    assert count == 1000
+
+    # The number of processes is otherwise limited by the number of CPUs.
+    monkeypatch.setattr(dbshare.db, "get_import_workers", lambda: 2)
+    monkeypatch.setitem(app.config, "IMPORT_PARALLEL_SIZE", 0)
+    monkeypatch.setitem(app.config, "IMPORT_CHUNK_SIZE", 1024)
+    count = saver.create_table_load_csv("parallel", csvfile, ",")
+    assert count == 1000
+    assert get_table(saver, "parallel") == get_table(saver, "serial")
+
+    # The record number in an error is counted from the start of the file.
+    with open(csvfile, "a") as outfile:
+        outfile.write("too,few\n")
+    with pytest.raises(ValueError, match="record 1001 has too few items"):
+        saver.create_table_load_csv("bad", csvfile, ",")
+    assert "bad" not in saver.db["tables"]